@@ -7,13 +7,15 @@ Includes caching, rate limiting, performance monitoring, and optimizations
 import os
 import logging
 import random
-import uuid
+import base64
 import sys
 import asyncio
 import time
 import re
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
+from functools import lru_cache
 from telegram import Update, InlineKeyboardMarkup, InlineKeyboardButton
+from telegram.error import BadRequest
 from telegram.ext import (
     ApplicationBuilder,
     CommandHandler,
@@ -22,7 +24,8 @@ from telegram.ext import (
     ContextTypes,
     CallbackContext,
     CallbackQueryHandler,
-    ConversationHandler
+    ConversationHandler,
+    TypeHandler
 )
 
 # Import custom modules
@@ -30,7 +33,7 @@ from config import config, setup_logging, validate_environment
 from database import init_database, close_database, get_db
 from performance_optimizer import (
     cached, rate_limited, monitored, 
-    cache, performance_monitor, user_rate_limiter,
+    cache, performance_monitor, user_rate_limiter, request_coalescer, current_user_id,
     preload_cache, cleanup_resources, get_performance_stats
 )
 
@@ -56,12 +59,105 @@ MIKASA_QUOTES = {
     'welcome': ["Welcome to our group! I'll protect everyone here.", "A new comrade has joined our ranks. Together we'll fight!"]
 }
 
+# Links channel post layouts
+FILE_LINK_TEMPLATE = (
+    "🔗 File Link\n\n"
+    "ID: {id}\n"
+    "Name: {name}\n"
+    "Type: {type}\n"
+    "Date: {date}\n"
+    "Caption: {caption}\n"
+    "Message ID: {message_id}\n\n"
+    "Link: {link}\n\n"
+    "#file_{id}"
+)
+
+BATCH_LINK_TEMPLATE = (
+    "🔗 Batch Link\n\n"
+    "ID: {id}\n"
+    "Files: {files}\n"
+    "Date: {date}\n"
+    "Total Files: {total}\n"
+    "Link: {link}\n\n"
+    "#batch_{id}\n"
+    "#batch_files_{file_ids}"
+)
+
+GROUP_CHAT_TYPES = frozenset({"group", "supergroup"})
+
+# Static keyboards, built once since PTB markups are immutable
+MAIN_MENU_BUTTON = InlineKeyboardButton("📋 Main Menu", callback_data="menu")
+MAIN_MENU_MARKUP = InlineKeyboardMarkup([[MAIN_MENU_BUTTON]])
+BACK_TO_MENU_MARKUP = InlineKeyboardMarkup([[InlineKeyboardButton("🔙 Back", callback_data="menu")]])
+
+STATIC_TOKEN_MARKUP = None
+STATIC_TOKEN_MENU_MARKUP = None
+
+def build_static_markups():
+    """(Re)build the Get Token markups when GET_TOKEN is a static URL"""
+    global STATIC_TOKEN_MARKUP, STATIC_TOKEN_MENU_MARKUP
+    
+    if config.GET_TOKEN and config.GET_TOKEN.startswith(('http://', 'https://')):
+        get_token_button = InlineKeyboardButton("Get Token", url=config.GET_TOKEN)
+        STATIC_TOKEN_MARKUP = InlineKeyboardMarkup([[get_token_button]])
+        STATIC_TOKEN_MENU_MARKUP = InlineKeyboardMarkup([[get_token_button], [MAIN_MENU_BUTTON]])
+    else:
+        STATIC_TOKEN_MARKUP = None
+        STATIC_TOKEN_MENU_MARKUP = None
+
+build_static_markups()
+
+# Bound concurrent Telegram API calls to stay under the bot-wide flood limit
+TELEGRAM_SEND_CONCURRENCY = 25
+_send_semaphore = None
+
+def get_send_semaphore() -> asyncio.Semaphore:
+    """Get the shared send semaphore, created lazily inside the running loop"""
+    global _send_semaphore
+    if _send_semaphore is None:
+        _send_semaphore = asyncio.Semaphore(TELEGRAM_SEND_CONCURRENCY)
+    return _send_semaphore
+
+async def gather_bounded(coros, return_exceptions: bool = True):
+    """Gather coroutines while holding the shared send semaphore for each"""
+    semaphore = get_send_semaphore()
+    
+    async def _run(coro):
+        async with semaphore:
+            return await coro
+    
+    return await asyncio.gather(*(_run(coro) for coro in coros), return_exceptions=return_exceptions)
+
+def generate_id() -> str:
+    """Generate a 22-char URL-safe random ID for files, batches and tokens"""
+    return base64.urlsafe_b64encode(os.urandom(16)).rstrip(b"=").decode("ascii")
+
+# Replies with the trailing newline pre-joined, as tuples per category
+MIKASA_REPLIES = {
+    category: tuple(quote + "\n" for quote in quotes)
+    for category, quotes in MIKASA_QUOTES.items()
+}
+_DEFAULT_REPLIES = MIKASA_REPLIES['default']
+
+def build_start_link(context, payload: str) -> str:
+    """Build a t.me deep link, using the bot username prefix cached in bot_data"""
+    prefix = context.bot_data.get("start_link_prefix")
+    if prefix is None:
+        prefix = context.bot_data["start_link_prefix"] = f"t.me/{context.bot.username}?start="
+    return prefix + payload
+
+def utc_timestamp(dt: datetime) -> float:
+    """Convert a datetime to an epoch timestamp, treating naive values as UTC like MongoDB does"""
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return dt.timestamp()
+
 def mikasa_reply(category='default'):
-    return random.choice(MIKASA_QUOTES.get(category, MIKASA_QUOTES['default'])) + "\n"
+    return random.choice(MIKASA_REPLIES.get(category, _DEFAULT_REPLIES))
 
 def admin_only(func):
     async def wrapper(update: Update, context: ContextTypes.DEFAULT_TYPE):
-        if not config.is_admin(update.effective_user.id):
+        if update.effective_user.id not in config.ADMIN_SET:
             await update.message.reply_text(mikasa_reply('warning') + "Unauthorized!")
             return
         return await func(update, context)
@@ -75,6 +171,11 @@ def owner_only(func):
         return await func(update, context)
     return wrapper
 
+async def track_current_user(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Publish the update's user to @monitored before any other handler runs"""
+    user = update.effective_user
+    current_user_id.set(user.id if user else None)
+
 @monitored
 async def error_handler(update: object, context: ContextTypes.DEFAULT_TYPE):
     """Enhanced error handler with database logging and monitoring"""
@@ -107,10 +208,13 @@ async def error_handler(update: object, context: ContextTypes.DEFAULT_TYPE):
         logger.error(f"Failed to handle error: {e}")
 
 # ========== TOKEN VERIFICATION SYSTEM ========== #
-@cached(ttl=1800, key_func=lambda user_id, context: f"token_gen_{user_id}")
+# Deep-link payload prefix marking a token verification
+VERIFY_PREFIX = "verify_"
+
+@cached(ttl=1800, key_func=lambda user_id, context: ("token_gen", user_id))
 async def generate_token(user_id, context):
     """Generate a unique token for a user with caching"""
-    token = str(uuid.uuid4())
+    token = generate_id()
     expiry = datetime.utcnow() + timedelta(hours=config.TOKEN_DURATION)
     
     # Store token in database
@@ -122,42 +226,61 @@ async def generate_token(user_id, context):
         return None, None
     
     # Create verification URL
-    bot_username = context.bot.username
-    verification_url = f"https://t.me/{bot_username}?start=verify_{token}"
+    verification_url = "https://" + build_start_link(context, VERIFY_PREFIX + token)
     
     # Send direct token URL to all admins
     expiry_time = expiry.strftime('%Y-%m-%d %H:%M:%S')
     token_message = f"🔑 New Token Generated\n\nVerification URL: {verification_url}\nExpires: {expiry_time}"
     
-    # Send to admins in parallel
-    admin_tasks = []
-    for admin_id in config.ADMINS:
-        task = context.bot.send_message(chat_id=admin_id, text=token_message)
-        admin_tasks.append(task)
-    
-    if admin_tasks:
-        await asyncio.gather(*admin_tasks, return_exceptions=True)
+    # Send to admins in parallel, bounded by the shared send semaphore
+    if config.ADMINS:
+        results = await gather_bounded(
+            context.bot.send_message(chat_id=admin_id, text=token_message)
+            for admin_id in config.ADMINS
+        )
+        
+        for admin_id, result in zip(config.ADMINS, results):
+            if isinstance(result, Exception):
+                logger.error(f"Failed to send token URL to admin {admin_id}: {result}")
     
-    # Send and pin token URL in database channel
+    # Update the pinned token URL in database channel, pinning a new one only if needed
+    channel_text = f"🔑 Current Access Token (valid for {config.TOKEN_DURATION} hours)\n\nVerification URL: {verification_url}"
     try:
-        db_msg = await context.bot.send_message(
-            chat_id=config.DATABASE_CHANNEL,
-            text=f"🔑 Current Access Token (valid for {config.TOKEN_DURATION} hours)\n\nVerification URL: {verification_url}"
-        )
+        pinned_msg_id = await db.get_system_value("pinned_token_msg_id")
         
-        await context.bot.pin_chat_message(
-            chat_id=config.DATABASE_CHANNEL,
-            message_id=db_msg.message_id,
-            disable_notification=True
-        )
-        logger.info(f"Pinned token URL message {db_msg.message_id} in database channel")
+        if pinned_msg_id:
+            try:
+                await context.bot.edit_message_text(
+                    chat_id=config.DATABASE_CHANNEL,
+                    message_id=pinned_msg_id,
+                    text=channel_text
+                )
+                logger.info("Updated pinned token URL message %s in database channel", pinned_msg_id)
+            except BadRequest as e:
+                # Pinned message was deleted or can no longer be edited
+                logger.warning(f"Could not edit pinned token message {pinned_msg_id}: {e}")
+                pinned_msg_id = None
+        
+        if not pinned_msg_id:
+            db_msg = await context.bot.send_message(
+                chat_id=config.DATABASE_CHANNEL,
+                text=channel_text
+            )
+            
+            await context.bot.pin_chat_message(
+                chat_id=config.DATABASE_CHANNEL,
+                message_id=db_msg.message_id,
+                disable_notification=True
+            )
+            await db.set_system_value("pinned_token_msg_id", db_msg.message_id)
+            logger.info("Pinned token URL message %s in database channel", db_msg.message_id)
         
     except Exception as e:
         logger.error(f"Failed to send/pin token URL in database channel: {e}")
     
     return token, verification_url
 
-@cached(ttl=60, key_func=lambda token: f"verify_token_{token}")
+@cached(ttl=60, key_func=lambda token: ("verify_token", token))
 async def verify_token(token):
     """Verify if a token is valid and not expired with caching"""
     try:
@@ -168,7 +291,7 @@ async def verify_token(token):
         logger.error(f"Error verifying token: {e}")
         return None
 
-@cached(ttl=300, key_func=lambda user_id: f"user_token_{user_id}")
+@cached(ttl=300, key_func=lambda user_id: ("user_token", user_id))
 async def check_user_token(user_id):
     """Check if a user has a valid token with caching"""
     try:
@@ -178,6 +301,110 @@ async def check_user_token(user_id):
         logger.error(f"Error checking user token: {e}")
         return False
 
+# Ban status per user_id as (is_banned, expires_at on the monotonic clock).
+# While the change stream watcher is running, bans are invalidated as they
+# happen and entries can live much longer.
+BAN_CACHE_TTL = 300
+BAN_CACHE_WATCHED_TTL = 3600
+ban_cache_ttl = BAN_CACHE_TTL
+_ban_cache = {}
+
+def invalidate_ban_status(user_id: int):
+    """Drop the cached ban status for a user"""
+    _ban_cache.pop(user_id, None)
+
+async def get_ban_status(user_id: int) -> bool:
+    """Check if a user is banned with caching"""
+    now = time.monotonic()
+    entry = _ban_cache.get(user_id)
+    if entry is not None and entry[1] > now:
+        return entry[0]
+    
+    try:
+        db = get_db()
+        is_banned = await db.is_user_banned(user_id)
+    except Exception as e:
+        logger.error(f"Error checking ban status: {e}")
+        return False
+    
+    # Dicts keep insertion order, so re-inserting moves the user to the end and
+    # the first key is always the oldest (soonest-expiring) entry to evict
+    _ban_cache.pop(user_id, None)
+    if _ban_cache and len(_ban_cache) >= config.CACHE_MAX_SIZE:
+        del _ban_cache[next(iter(_ban_cache))]
+    
+    _ban_cache[user_id] = (is_banned, now + ban_cache_ttl)
+    return is_banned
+
+async def check_access(user_id: int):
+    """Run the ban and token checks concurrently, returning (is_banned, has_valid_token)"""
+    if not config.TOKEN_VERIFICATION_ENABLED:
+        return await get_ban_status(user_id), True
+    
+    is_banned, has_valid_token = await asyncio.gather(
+        get_ban_status(user_id),
+        check_user_token(user_id)
+    )
+    return is_banned, has_valid_token
+
+async def build_token_markup(user_id: int, context, with_menu: bool = False) -> InlineKeyboardMarkup:
+    """Build the "Get Token" markup for a user without a valid token"""
+    if STATIC_TOKEN_MARKUP is not None:
+        return STATIC_TOKEN_MENU_MARKUP if with_menu else STATIC_TOKEN_MARKUP
+    
+    _, verification_url = await generate_token(user_id, context)
+    keyboard = [[InlineKeyboardButton("Get Token", url=verification_url)]]
+    if with_menu:
+        keyboard.append([MAIN_MENU_BUTTON])
+    return InlineKeyboardMarkup(keyboard)
+
+def _on_database_change(change: dict):
+    """Invalidate per-user caches touched by a users/tokens change event"""
+    user_id = (change.get("fullDocument") or {}).get("user_id")
+    if user_id is None:
+        return
+    
+    if change["ns"]["coll"] == "users":
+        invalidate_ban_status(user_id)
+    elif user_id != 0:
+        check_user_token.cache_invalidate(user_id)
+
+_cache_watch_task = None
+
+async def _watch_cache_invalidations():
+    """Keep per-user caches in sync with MongoDB via a change stream"""
+    global ban_cache_ttl
+    
+    try:
+        db = get_db()
+        ban_cache_ttl = BAN_CACHE_WATCHED_TTL
+        await db.watch_changes(("users", "tokens"), _on_database_change)
+    except asyncio.CancelledError:
+        raise
+    except Exception as e:
+        logger.warning(f"Change stream unavailable, using TTL-based cache expiry: {e}")
+    finally:
+        # Entries cached under the long TTL can no longer be trusted
+        ban_cache_ttl = BAN_CACHE_TTL
+        _ban_cache.clear()
+
+def start_cache_watcher():
+    """Start the change stream watcher in the running loop"""
+    global _cache_watch_task
+    if _cache_watch_task is None or _cache_watch_task.done():
+        _cache_watch_task = asyncio.create_task(_watch_cache_invalidations())
+
+async def stop_cache_watcher():
+    """Stop the change stream watcher"""
+    global _cache_watch_task
+    if _cache_watch_task:
+        _cache_watch_task.cancel()
+        try:
+            await _cache_watch_task
+        except asyncio.CancelledError:
+            pass
+        _cache_watch_task = None
+
 async def refresh_token(context: CallbackContext):
     """Generate a new token only if no valid token exists or current token is about to expire"""
     logger.info("Scheduled token refresh triggered")
@@ -188,15 +415,14 @@ async def refresh_token(context: CallbackContext):
         
         if token_info:
             expiry = token_info["expiry"]
-            current_time = datetime.utcnow()
             
             # If token still has more than 1 hour of validity, don't generate a new one
-            if expiry - current_time > timedelta(hours=1):
-                logger.info(f"Using existing valid token that expires at {expiry}")
+            if utc_timestamp(expiry) - time.time() > 3600:
+                logger.info("Using existing valid token that expires at %s", expiry)
                 return
         
         # Clear cache for token generation
-        cache.delete("token_gen_0")
+        generate_token.cache_invalidate(0, context)
         
         # No valid token found or token is about to expire, generate a new one
         logger.info("No valid token found or token is about to expire, generating a new one")
@@ -213,18 +439,7 @@ async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
     args = context.args
     
-    # Check ban status with caching
-    cache_key = f"ban_status_{user_id}"
-    is_banned = cache.get(cache_key)
-    
-    if is_banned is None:
-        try:
-            db = get_db()
-            is_banned = await db.is_user_banned(user_id)
-            cache.set(cache_key, is_banned, ttl=300)  # Cache for 5 minutes
-        except Exception as e:
-            logger.error(f"Error checking ban status: {e}")
-            is_banned = False
+    is_banned, has_valid_token = await check_access(user_id)
     
     if is_banned:
         await update.message.reply_text(mikasa_reply('ban') + "You are banned from using this bot!")
@@ -235,15 +450,15 @@ async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         arg = args[0]
         
         # Check if it's a token verification
-        if arg.startswith("verify_"):
-            token = arg[7:]  # Remove "verify_" prefix
-            logger.info(f"Verifying token: {token} for user {user_id}")
+        token = arg.removeprefix(VERIFY_PREFIX)
+        if token is not arg:
+            logger.info("Verifying token: %s for user %s", token, user_id)
             
             verified_user_id = await verify_token(token)
             
             if verified_user_id is not None and (verified_user_id == user_id or verified_user_id == 0):
                 # Clear user token cache
-                cache.delete(f"user_token_{user_id}")
+                check_user_token.cache_invalidate(user_id)
                 
                 await update.message.reply_text(
                     mikasa_reply('success') + "Token verified successfully! You now have access for 24 hours."
@@ -255,26 +470,16 @@ async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 )
                 return
         
-        # Check if user has a valid token (only if token verification is enabled)
-        if config.TOKEN_VERIFICATION_ENABLED:
-            has_valid_token = await check_user_token(user_id)
+        # Check if user has a valid token (always true when verification is disabled)
+        if not has_valid_token:
+            reply_markup = await build_token_markup(user_id, context)
             
-            if not has_valid_token:
-                keyboard = []
-                if config.GET_TOKEN and config.GET_TOKEN.startswith(('http://', 'https://')):
-                    keyboard.append([InlineKeyboardButton("Get Token", url=config.GET_TOKEN)])
-                else:
-                    _, verification_url = await generate_token(user_id, context)
-                    keyboard.append([InlineKeyboardButton("Get Token", url=verification_url)])
-                
-                reply_markup = InlineKeyboardMarkup(keyboard)
-                
-                await update.message.reply_text(
-                    mikasa_reply('warning') + "You need to verify access to use this bot.\n\n"
-                    "Click the button below to get a 24-hour access token:",
-                    reply_markup=reply_markup
-                )
-                return
+            await update.message.reply_text(
+                mikasa_reply('warning') + "You need to verify access to use this bot.\n\n"
+                "Click the button below to get a 24-hour access token:",
+                reply_markup=reply_markup
+            )
+            return
         
         # If we get here, user has a valid token, proceed with file/batch handling
         await send_file(update, context)
@@ -290,32 +495,18 @@ async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     )
     
     # Check token verification
-    if config.TOKEN_VERIFICATION_ENABLED:
-        has_valid_token = await check_user_token(user_id)
+    if not has_valid_token:
+        reply_markup = await build_token_markup(user_id, context, with_menu=True)
         
-        if not has_valid_token:
-            keyboard = []
-            if config.GET_TOKEN and config.GET_TOKEN.startswith(('http://', 'https://')):
-                keyboard.append([InlineKeyboardButton("Get Token", url=config.GET_TOKEN)])
-            else:
-                _, verification_url = await generate_token(user_id, context)
-                keyboard.append([InlineKeyboardButton("Get Token", url=verification_url)])
-            
-            keyboard.append([InlineKeyboardButton("📋 Main Menu", callback_data="menu")])
-            reply_markup = InlineKeyboardMarkup(keyboard)
-            
-            await update.message.reply_text(
-                welcome_message + "\n\nYou need to verify access to use this bot.\n"
-                "Click the button below to get a 24-hour access token:",
-                reply_markup=reply_markup
-            )
-            return
+        await update.message.reply_text(
+            welcome_message + "\n\nYou need to verify access to use this bot.\n"
+            "Click the button below to get a 24-hour access token:",
+            reply_markup=reply_markup
+        )
+        return
     
     # User has valid token or verification disabled
-    keyboard = [[InlineKeyboardButton("📋 Main Menu", callback_data="menu")]]
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    
-    await update.message.reply_text(welcome_message, reply_markup=reply_markup)
+    await update.message.reply_text(welcome_message, reply_markup=MAIN_MENU_MARKUP)
 
 @owner_only
 @monitored
@@ -375,7 +566,7 @@ async def performance_stats_command(update: Update, context: ContextTypes.DEFAUL
 @monitored
 async def start_batch(update: Update, context: ContextTypes.DEFAULT_TYPE):
     context.user_data['batch'] = []
-    logger.info(f"Started new batch for user {update.effective_user.id}")
+    logger.info("Started new batch for user %s", update.effective_user.id)
     await update.message.reply_text(mikasa_reply('success') + "Batch collection started!")
 
 @admin_only
@@ -386,7 +577,7 @@ async def end_batch(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
     
     batch_files = context.user_data['batch']
-    batch_id = str(uuid.uuid4())
+    batch_id = generate_id()
     
     try:
         # Store batch in database
@@ -401,29 +592,29 @@ async def end_batch(update: Update, context: ContextTypes.DEFAULT_TYPE):
             await update.message.reply_text(mikasa_reply('error') + "Failed to save batch!")
             return
         
-        batch_link = f"t.me/{context.bot.username}?start={batch_id}"
+        batch_link = build_start_link(context, batch_id)
         
         # Store batch link in links channel if configured
         if config.LINKS_CHANNEL:
             try:
-                date_str = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+                date_str = time.strftime("%Y-%m-%d %H:%M:%S")
                 files_str = ", ".join(batch_files)
                 if len(files_str) > 100:
                     files_str = files_str[:97] + "..."
                 
                 link_msg = await context.bot.send_message(
                     chat_id=config.LINKS_CHANNEL,
-                    text=f"🔗 Batch Link\n\n"
-                         f"ID: {batch_id}\n"
-                         f"Files: {files_str}\n"
-                         f"Date: {date_str}\n"
-                         f"Total Files: {len(batch_files)}\n"
-                         f"Link: {batch_link}\n\n"
-                         f"#batch_{batch_id}\n"
-                         f"#batch_files_{','.join(batch_files)}"
+                    text=BATCH_LINK_TEMPLATE.format(
+                        id=batch_id,
+                        files=files_str,
+                        date=date_str,
+                        total=len(batch_files),
+                        link=batch_link,
+                        file_ids=",".join(batch_files)
+                    )
                 )
                 
-                logger.info(f"Stored batch link in links channel, message ID: {link_msg.message_id}")
+                logger.info("Stored batch link in links channel, message ID: %s", link_msg.message_id)
                 
             except Exception as e:
                 logger.error(f"Failed to store batch link in links channel: {e}")
@@ -465,7 +656,7 @@ async def store_file(update: Update, context: ContextTypes.DEFAULT_TYPE):
             return
     
     # Regular file storage
-    file_id = str(uuid.uuid4())
+    file_id = generate_id()
     custom_filename = context.user_data.pop('custom_filename', None)
     
     try:
@@ -476,7 +667,9 @@ async def store_file(update: Update, context: ContextTypes.DEFAULT_TYPE):
             message_id=update.message.message_id
         )
         
-        file_link = f"t.me/{context.bot.username}?start={file_id}"
+        file_link = build_start_link(context, file_id)
+        media_type = get_media_type(update.message)
+        caption = update.message.caption or ""
         
         # Store file metadata in database
         db = get_db()
@@ -484,8 +677,8 @@ async def store_file(update: Update, context: ContextTypes.DEFAULT_TYPE):
             file_id=file_id,
             message_id=msg.message_id,
             custom_name=custom_filename or "",
-            media_type=get_media_type(update.message),
-            caption=update.message.caption or "",
+            media_type=media_type,
+            caption=caption,
             file_link=file_link,
             created_by=update.effective_user.id
         )
@@ -493,28 +686,29 @@ async def store_file(update: Update, context: ContextTypes.DEFAULT_TYPE):
         if not success:
             await update.message.reply_text(mikasa_reply('error') + "Failed to store file!")
             return
+
+        # New files must show up in searches without waiting for the cache TTL
+        invalidate_search_cache()
         
         # Store complete file metadata in links channel if configured
         if config.LINKS_CHANNEL:
             try:
-                media_type = get_media_type(update.message)
-                caption = update.message.caption or ""
-                date_str = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+                date_str = time.strftime("%Y-%m-%d %H:%M:%S")
                 
                 link_msg = await context.bot.send_message(
                     chat_id=config.LINKS_CHANNEL,
-                    text=f"🔗 File Link\n\n"
-                         f"ID: {file_id}\n"
-                         f"Name: {custom_filename if custom_filename else 'Unnamed file'}\n"
-                         f"Type: {media_type}\n"
-                         f"Date: {date_str}\n"
-                         f"Caption: {caption}\n"
-                         f"Message ID: {msg.message_id}\n\n"
-                         f"Link: {file_link}\n\n"
-                         f"#file_{file_id}"
+                    text=FILE_LINK_TEMPLATE.format(
+                        id=file_id,
+                        name=custom_filename if custom_filename else 'Unnamed file',
+                        type=media_type,
+                        date=date_str,
+                        caption=caption,
+                        message_id=msg.message_id,
+                        link=file_link
+                    )
                 )
                 
-                logger.info(f"Stored file metadata in links channel, message ID: {link_msg.message_id}")
+                logger.info("Stored file metadata in links channel, message ID: %s", link_msg.message_id)
                 
             except Exception as e:
                 logger.error(f"Failed to store file metadata in links channel: {e}")
@@ -532,26 +726,32 @@ async def store_file(update: Update, context: ContextTypes.DEFAULT_TYPE):
         logger.error(f"Error storing file: {e}")
         await update.message.reply_text(mikasa_reply('error') + "Failed to store file!")
 
+# Message attributes probed in priority order to determine the media type
+MEDIA_TYPES = ("photo", "video", "audio", "document", "animation", "voice", "video_note", "sticker")
+
 def get_media_type(message):
     """Determine the type of media in a message"""
-    if message.photo:
-        return "photo"
-    elif message.video:
-        return "video"
-    elif message.audio:
-        return "audio"
-    elif message.document:
-        return "document"
-    elif message.animation:
-        return "animation"
-    elif message.voice:
-        return "voice"
-    elif message.video_note:
-        return "video_note"
-    elif message.sticker:
-        return "sticker"
-    else:
-        return "unknown"
+    return next((media_type for media_type in MEDIA_TYPES if getattr(message, media_type, None)), "unknown")
+
+# Bot API limit on message IDs per copyMessages call
+COPY_MESSAGES_LIMIT = 100
+
+def group_delivery_runs(entries):
+    """Split ordered (message_id, caption) pairs into runs for delivery.
+    
+    Uncaptioned messages with strictly increasing IDs are grouped for a single
+    copy_messages call; captioned messages are delivered one by one since
+    copy_messages cannot override captions.
+    """
+    runs = []
+    for message_id, caption in entries:
+        last = runs[-1] if runs else None
+        if (caption is None and last is not None and last[1] is None
+                and len(last[0]) < COPY_MESSAGES_LIMIT and last[0][-1] < message_id):
+            last[0].append(message_id)
+        else:
+            runs.append(([message_id], caption))
+    return runs
 
 @monitored
 @rate_limited(max_requests=20, window_seconds=60)
@@ -559,43 +759,22 @@ async def send_file(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
     file_id = context.args[0] if context.args else None
     
-    # Check ban status with caching
-    cache_key = f"ban_status_{user_id}"
-    is_banned = cache.get(cache_key)
-    
-    if is_banned is None:
-        try:
-            db = get_db()
-            is_banned = await db.is_user_banned(user_id)
-            cache.set(cache_key, is_banned, ttl=300)
-        except Exception as e:
-            logger.error(f"Error checking ban status: {e}")
-            is_banned = False
+    is_banned, has_valid_token = await check_access(user_id)
     
     if is_banned:
         await update.message.reply_text(mikasa_reply('ban') + "Banned!")
         return
     
     # Check token verification
-    if config.TOKEN_VERIFICATION_ENABLED:
-        has_valid_token = await check_user_token(user_id)
+    if not has_valid_token:
+        reply_markup = await build_token_markup(user_id, context)
         
-        if not has_valid_token:
-            keyboard = []
-            if config.GET_TOKEN and config.GET_TOKEN.startswith(('http://', 'https://')):
-                keyboard.append([InlineKeyboardButton("Get Token", url=config.GET_TOKEN)])
-            else:
-                _, verification_url = await generate_token(user_id, context)
-                keyboard.append([InlineKeyboardButton("Get Token", url=verification_url)])
-            
-            reply_markup = InlineKeyboardMarkup(keyboard)
-            
-            await update.message.reply_text(
-                mikasa_reply('warning') + "You need to verify access to use this bot.\n\n"
-                "Click the button below to get a 24-hour access token:",
-                reply_markup=reply_markup
-            )
-            return
+        await update.message.reply_text(
+            mikasa_reply('warning') + "You need to verify access to use this bot.\n\n"
+            "Click the button below to get a 24-hour access token:",
+            reply_markup=reply_markup
+        )
+        return
     
     # Force subscription check
     if config.FORCE_SUB != 0:
@@ -629,18 +808,18 @@ async def send_file(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 await update.message.reply_text(mikasa_reply('warning') + "Invalid file data!")
                 return
             
-            custom_name = file_data.get("custom_name")
-            caption = f"{custom_name}" if custom_name else None
+            # custom_name is stored as "" when unset; None keeps the original caption
+            caption = file_data.get("custom_name") or None
             
             try:
-                sent_msg = await context.bot.copy_message(
+                await context.bot.copy_message(
                     chat_id=update.effective_chat.id,
                     from_chat_id=config.DATABASE_CHANNEL,
                     message_id=message_id,
                     caption=caption,
                     protect_content=True
                 )
-                logger.info(f"Sent file {file_id} to user {user_id}")
+                logger.info("Sent file %s to user %s", file_id, user_id)
                 
             except Exception as e:
                 logger.error(f"Error sending file: {e}")
@@ -656,63 +835,56 @@ async def send_file(update: Update, context: ContextTypes.DEFAULT_TYPE):
                     await update.message.reply_text(mikasa_reply('warning') + "Invalid batch data!")
                     return
                 
-                sent_messages = []
-                missing_files = []
+                sent_count = 0
+                missing_count = 0
+                entries = []
                 
-                # Process files in smaller batches to avoid overwhelming
-                batch_size = 5
-                for i in range(0, len(batch_files), batch_size):
-                    batch_chunk = batch_files[i:i + batch_size]
-                    
-                    # Process chunk in parallel
-                    tasks = []
-                    for fid in batch_chunk:
-                        tasks.append(db.get_file(fid))
+                # Look up all batch files in one query, keeping the batch order
+                file_map = await db.get_files(batch_files)
+                
+                for fid in batch_files:
+                    file_data = file_map.get(fid)
+                    message_id = file_data.get("message_id") if file_data else None
                     
-                    file_results = await asyncio.gather(*tasks, return_exceptions=True)
+                    if not message_id:
+                        missing_count += 1
+                        continue
                     
-                    for fid, file_data in zip(batch_chunk, file_results):
-                        if isinstance(file_data, Exception):
-                            logger.error(f"Error getting batch file {fid}: {file_data}")
-                            missing_files.append(fid)
-                            continue
-                        
-                        if file_data:
-                            message_id = file_data.get("message_id")
-                            if not message_id:
-                                missing_files.append(fid)
-                                continue
-                            
-                            custom_name = file_data.get("custom_name")
-                            caption = f"{custom_name}" if custom_name else None
-                            
-                            try:
-                                sent_msg = await context.bot.copy_message(
-                                    chat_id=update.effective_chat.id,
-                                    from_chat_id=config.DATABASE_CHANNEL,
-                                    message_id=message_id,
-                                    caption=caption,
-                                    protect_content=True
-                                )
-                                sent_messages.append(sent_msg.message_id)
-                                
-                            except Exception as e:
-                                logger.error(f"Error sending batch file {fid}: {e}")
-                                missing_files.append(fid)
+                    entries.append((message_id, file_data.get("custom_name") or None))
+                
+                for message_ids, caption in group_delivery_runs(entries):
+                    try:
+                        if len(message_ids) > 1:
+                            sent = await context.bot.copy_messages(
+                                chat_id=update.effective_chat.id,
+                                from_chat_id=config.DATABASE_CHANNEL,
+                                message_ids=message_ids,
+                                protect_content=True
+                            )
+                            # Telegram silently skips messages it cannot copy
+                            sent_count += len(sent)
+                            missing_count += len(message_ids) - len(sent)
                         else:
-                            missing_files.append(fid)
-                    
-                    # Small delay between batches
-                    if i + batch_size < len(batch_files):
-                        await asyncio.sleep(0.5)
+                            await context.bot.copy_message(
+                                chat_id=update.effective_chat.id,
+                                from_chat_id=config.DATABASE_CHANNEL,
+                                message_id=message_ids[0],
+                                caption=caption,
+                                protect_content=True
+                            )
+                            sent_count += 1
+                        
+                    except Exception as e:
+                        logger.error(f"Error sending batch messages {message_ids}: {e}")
+                        missing_count += len(message_ids)
                 
                 # Notify about missing files
-                if missing_files:
+                if missing_count:
                     await update.message.reply_text(
-                        mikasa_reply('warning') + f"Some files in this batch ({len(missing_files)} of {len(batch_files)}) could not be found."
+                        mikasa_reply('warning') + f"Some files in this batch ({missing_count} of {len(batch_files)}) could not be found."
                     )
                 
-                if not sent_messages:
+                if not sent_count:
                     await update.message.reply_text(mikasa_reply('warning') + "No valid files in batch!")
             else:
                 await update.message.reply_text(mikasa_reply('warning') + "File or batch not found!")
@@ -738,8 +910,8 @@ async def ban_user(update: Update, context: ContextTypes.DEFAULT_TYPE):
         
         if success:
             # Clear cache for this user
-            cache.delete(f"ban_status_{user_id}")
-            cache.delete(f"user_token_{user_id}")
+            invalidate_ban_status(user_id)
+            check_user_token.cache_invalidate(user_id)
             
             await update.message.reply_text(mikasa_reply('ban') + f"Banned {user_id}!")
         else:
@@ -766,7 +938,7 @@ async def unban_user(update: Update, context: ContextTypes.DEFAULT_TYPE):
         
         if success:
             # Clear cache for this user
-            cache.delete(f"ban_status_{user_id}")
+            invalidate_ban_status(user_id)
             
             await update.message.reply_text(mikasa_reply('unban') + f"Unbanned {user_id}!")
         else:
@@ -794,31 +966,79 @@ async def list_banned(update: Update, context: ContextTypes.DEFAULT_TYPE):
         logger.error(f"Error listing banned users: {e}")
         await update.message.reply_text(mikasa_reply('error') + "Failed to list banned users!")
 
+# Settings text with only the per-call fields left as placeholders
+SETTINGS_TEMPLATE = ""
+
+def build_settings_template():
+    """(Re)render the static part of the /settings reply from config"""
+    global SETTINGS_TEMPLATE
+    
+    SETTINGS_TEMPLATE = (
+        "\n{reply}⚙️ Current Settings:\n"
+        f"• Force Sub: {config.FORCE_SUB if config.FORCE_SUB else 'Disabled'}\n"
+        f"• Admins: {len(config.ADMINS)} configured\n"
+        f"• Token Duration: {config.TOKEN_DURATION} hours\n"
+        "• Token Verification: {token_verification}\n"
+        "• Database: MongoDB (Optimized)\n"
+        f"• Links Channel: {'Configured' if config.LINKS_CHANNEL else 'Not configured'}\n"
+        f"• Cache TTL: {config.CACHE_TTL} seconds\n"
+        f"• Rate Limit: {config.RATE_LIMIT_REQUESTS} requests per {config.RATE_LIMIT_WINDOW} seconds\n"
+    )
+
+build_settings_template()
+
 @admin_only
 @monitored
 async def settings_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    settings_msg = f"""
-{mikasa_reply('info')}⚙️ Current Settings:
-• Force Sub: {config.FORCE_SUB if config.FORCE_SUB else 'Disabled'}
-• Admins: {len(config.ADMINS)} configured
-• Token Duration: {config.TOKEN_DURATION} hours
-• Token Verification: {'Enabled' if config.TOKEN_VERIFICATION_ENABLED else 'Disabled'}
-• Database: MongoDB (Optimized)
-• Links Channel: {'Configured' if config.LINKS_CHANNEL else 'Not configured'}
-• Cache TTL: {config.CACHE_TTL} seconds
-• Rate Limit: {config.RATE_LIMIT_REQUESTS} requests per {config.RATE_LIMIT_WINDOW} seconds
-"""
+    settings_msg = SETTINGS_TEMPLATE.format(
+        reply=mikasa_reply('info'),
+        token_verification='Enabled' if config.TOKEN_VERIFICATION_ENABLED else 'Disabled'
+    )
     await update.message.reply_text(settings_msg)
 
 @admin_only
 @monitored
 async def restart(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Reload configuration in-process, or re-exec the bot with /restart hard"""
+    if context.args != ["hard"]:
+        try:
+            config.reload()
+        except ValueError as e:
+            await update.message.reply_text(mikasa_reply('error') + f"Reload failed, keeping current settings:\n{e}")
+            return
+        
+        # Drop state derived from the old settings; the Mongo pool stays warm
+        build_static_markups()
+        build_settings_template()
+        cache.clear()
+        _ban_cache.clear()
+        
+        await update.message.reply_text(
+            mikasa_reply('success') + "Configuration reloaded!\n"
+            "Use /restart hard to also reconnect the database."
+        )
+        return
+    
     await update.message.reply_text(mikasa_reply('default') + "Rebooting...")
     await cleanup_resources()
     await close_database()
     os.execv(sys.executable, [sys.executable] + sys.argv)
 
 # ========== SEARCH FUNCTIONALITY ========== #
+# Leading "date:YYYY-MM-DD" filter in a search query
+DATE_SEARCH_PATTERN = re.compile(r"date:(\d{4}-\d{2}-\d{2})")
+
+SEARCH_CACHE_TTL = 300
+SEARCH_CACHE_JITTER = 30
+
+# Part of every search cache key; bumping it orphans all cached results
+_search_generation = 0
+
+def invalidate_search_cache():
+    """Make cached search results stale after the file set changes"""
+    global _search_generation
+    _search_generation += 1
+
 @monitored
 @rate_limited(max_requests=15, window_seconds=60)
 async def search_files(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -834,46 +1054,52 @@ async def search_files(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     search_query = ' '.join(context.args).lower()
     
-    # Update group stats if in a group
-    if update.effective_chat.type in ["group", "supergroup"]:
+    # Update group stats if in a group; written in the background, off the search path
+    if update.effective_chat.type in GROUP_CHAT_TYPES:
         try:
             db = get_db()
-            await db.update_group_stats(
+            if not db.queue_group_stats(
                 chat_id=update.effective_chat.id,
                 action_type="search",
                 user_id=update.effective_user.id,
                 search_term=search_query
-            )
+            ):
+                logger.warning("Group stats buffer full, dropping search stats")
         except Exception as e:
             logger.error(f"Error updating group stats: {e}")
     
     # Parse search query
     date_search = None
-    if search_query.startswith("date:"):
-        date_pattern = r"date:(\d{4}-\d{2}-\d{2})"
-        match = re.search(date_pattern, search_query)
-        if match:
-            date_search = match.group(1)
-            search_query = search_query.replace(f"date:{date_search}", "").strip()
+    match = DATE_SEARCH_PATTERN.match(search_query)
+    if match:
+        date_search = match.group(1)
+        search_query = search_query[match.end():].strip()
     
     # Check cache first
-    cache_key = f"search_{hash(search_query + str(date_search))}"
+    cache_key = ("search", _search_generation, search_query, date_search)
     cached_result = cache.get(cache_key)
     
     if cached_result:
         matching_files = cached_result
-        logger.debug(f"Using cached search results for query: {search_query}")
+        logger.debug("Using cached search results for query: %s", search_query)
     else:
         try:
+            # Concurrent identical searches share one database query
             db = get_db()
-            matching_files = await db.search_files(
+            matching_files = await request_coalescer.run(
+                cache_key,
+                db.search_files,
                 query=search_query if search_query else None,
                 date_filter=date_search,
                 limit=10
             )
             
-            # Cache results for 5 minutes
-            cache.set(cache_key, matching_files, ttl=300)
+            # Jittered TTL so popular queries cached together don't expire together
+            cache.set(
+                cache_key,
+                matching_files,
+                ttl=SEARCH_CACHE_TTL + random.uniform(0, SEARCH_CACHE_JITTER)
+            )
             
         except Exception as e:
             logger.error(f"Error searching files: {e}")
@@ -889,42 +1115,37 @@ async def search_files(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
     
     # Create response with inline keyboard
-    response_text = f"{mikasa_reply('success')}🔍 Search Results:\n\n"
-    keyboard = []
+    parts = [f"{mikasa_reply('success')}🔍 Search Results:\n\n"]
     
-    for i, file in enumerate(matching_files):
-        file_id = file["file_id"]
+    for i, file in enumerate(matching_files, 1):
         name = file.get("custom_name", "Unnamed file")
-        media_type = file.get("media_type", "unknown")
-        
-        media_icon = get_media_icon(media_type)
-        response_text += f"{i+1}. {media_icon} {name}\n"
-        
-        file_link = f"t.me/{context.bot.username}?start={file_id}"
-        keyboard.append([InlineKeyboardButton(f"📄 File {i+1}", url=file_link)])
-    
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    await update.message.reply_text(response_text, reply_markup=reply_markup)
-
-def get_media_icon(media_type):
-    """Return an appropriate icon for the media type"""
-    icons = {
-        "photo": "🖼️",
-        "video": "🎬",
-        "audio": "🎵",
-        "document": "📄",
-        "animation": "🎭",
-        "voice": "🎤",
-        "video_note": "⭕",
-        "sticker": "🏷️"
-    }
-    return icons.get(media_type, "📁")
+        media_icon = MEDIA_ICONS.get(file.get("media_type", "unknown"), "📁")
+        parts.append(f"{i}. {media_icon} {name}\n")
+    
+    url_prefix = build_start_link(context, "")
+    reply_markup = InlineKeyboardMarkup([
+        [InlineKeyboardButton(f"📄 File {i}", url=url_prefix + file["file_id"])]
+        for i, file in enumerate(matching_files, 1)
+    ])
+    await update.message.reply_text("".join(parts), reply_markup=reply_markup)
+
+# Icons per media type for search results
+MEDIA_ICONS = {
+    "photo": "🖼️",
+    "video": "🎬",
+    "audio": "🎵",
+    "document": "📄",
+    "animation": "🎭",
+    "voice": "🎤",
+    "video_note": "⭕",
+    "sticker": "🏷️"
+}
 
 # ========== GROUP FEATURES ========== #
 @monitored
 async def group_stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Show group statistics with caching"""
-    if update.effective_chat.type not in ["group", "supergroup"]:
+    if update.effective_chat.type not in GROUP_CHAT_TYPES:
         await update.message.reply_text(
             mikasa_reply('warning') + "This command can only be used in group chats."
         )
@@ -932,7 +1153,7 @@ async def group_stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE
     
     try:
         # Check cache first
-        cache_key = f"group_stats_{update.effective_chat.id}"
+        cache_key = ("group_stats", update.effective_chat.id)
         cached_stats = cache.get(cache_key)
         
         if cached_stats:
@@ -959,16 +1180,66 @@ async def group_stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE
         await update.message.reply_text(mikasa_reply('error') + "Failed to get group statistics!")
 
 # ========== UI HANDLERS ========== #
-@monitored
-async def menu_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Show the main menu"""
+HELP_TEXT = (
+    "Help Information:\n\n"
+    "• To access a file, use the provided link\n"
+    "• You need a valid token to access files\n"
+    "• Use /search <keywords> to find files\n\n"
+    "Commands:\n"
+    "/start - Start the bot\n"
+    "/menu - Show main menu\n"
+    "/help - Show this help\n"
+    "/search - Search for files"
+)
+
+HELP_ADMIN_TEXT = (
+    "\n\nAdmin Commands:\n"
+    "/getlink - Store a file\n"
+    "/firstbatch - Start batch\n"
+    "/lastbatch - End batch\n"
+    "/rename - Rename next file\n"
+    "/ban <user_id> - Ban user\n"
+    "/unban <user_id> - Unban user\n"
+    "/settings - Show settings\n"
+    "/restart [hard] - Reload settings (hard: restart bot)"
+)
+
+HELP_OWNER_TEXT = (
+    "\n\nOwner Commands:\n"
+    "/tokentoggle - Toggle token verification\n"
+    "/performance - Show performance stats"
+)
+
+# Rendered help per (is_admin, is_owner), without the leading Mikasa line
+HELP_TEXTS = {
+    (is_admin, is_owner): HELP_TEXT + (HELP_ADMIN_TEXT if is_admin else "") + (HELP_OWNER_TEXT if is_owner else "")
+    for is_admin in (False, True)
+    for is_owner in (False, True)
+}
+
+ABOUT_TEXT = (
+    "About This Bot:\n\n"
+    "High-performance file sharing bot with MongoDB integration.\n\n"
+    "Features:\n"
+    "• MongoDB storage with connection pooling\n"
+    "• Advanced caching system\n"
+    "• Rate limiting and performance monitoring\n"
+    "• Token verification system\n"
+    "• Batch file sharing\n"
+    "• Optimized for thousands of concurrent users\n"
+    "• Real-time performance statistics"
+)
+
+@lru_cache(maxsize=8)
+def build_main_menu(is_admin: bool, is_owner: bool, is_group: bool) -> InlineKeyboardMarkup:
+    """Build the main menu markup for a role and chat kind (cached per combination)"""
     keyboard = [
         [InlineKeyboardButton("📚 Help", callback_data="help")],
         [InlineKeyboardButton("ℹ️ About", callback_data="about")],
         [InlineKeyboardButton("🔍 Search Files", callback_data="search_menu")]
     ]
     
-    if config.is_admin(update.effective_user.id):
+    if is_admin:
         keyboard.extend([
             [InlineKeyboardButton("🔄 Start Batch", callback_data="start_batch"),
              InlineKeyboardButton("✅ End Batch", callback_data="end_batch")],
@@ -976,19 +1247,38 @@ async def menu_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
             [InlineKeyboardButton("⚙️ Settings", callback_data="settings")]
         ])
     
-    if config.is_owner(update.effective_user.id):
+    if is_owner:
         keyboard.append([
             InlineKeyboardButton("📊 Performance", callback_data="performance"),
             InlineKeyboardButton("🛠️ Admin Panel", callback_data="admin_panel")
         ])
     
-    if update.effective_chat.type in ["group", "supergroup"]:
+    if is_group:
         keyboard.append([InlineKeyboardButton("📊 Group Stats", callback_data="group_stats")])
     
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    await update.message.reply_text(mikasa_reply('info') + "Main Menu:", reply_markup=reply_markup)
+    return InlineKeyboardMarkup(keyboard)
+
+def get_main_menu_markup(update: Update) -> InlineKeyboardMarkup:
+    """Get the main menu markup for the user and chat of an update"""
+    user_id = update.effective_user.id
+    chat = update.effective_chat
+    return build_main_menu(
+        config.is_admin(user_id),
+        config.is_owner(user_id),
+        chat is not None and chat.type in GROUP_CHAT_TYPES
+    )
+
+def get_help_text(user_id: int) -> str:
+    """Get the prerendered help text for a user's role"""
+    return HELP_TEXTS[(config.is_admin(user_id), config.is_owner(user_id))]
 
 @monitored
+async def menu_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Show the main menu"""
+    reply_markup = get_main_menu_markup(update)
+    await update.message.reply_text(mikasa_reply('info') + "Main Menu:", reply_markup=reply_markup)
+
+@monitored(sample_rate=0.1)
 async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle button callbacks"""
     query = update.callback_query
@@ -1008,134 +1298,35 @@ async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
             f"🧠 Memory: {perf['memory_usage_mb']:.2f}MB"
         )
         
-        keyboard = [[InlineKeyboardButton("🔙 Back", callback_data="menu")]]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        await query.edit_message_text(stats_text, reply_markup=reply_markup)
+        await query.edit_message_text(stats_text, reply_markup=BACK_TO_MENU_MARKUP)
         return
     
     # Handle other standard menu options
     if query.data == "menu":
-        keyboard = [
-            [InlineKeyboardButton("📚 Help", callback_data="help")],
-            [InlineKeyboardButton("ℹ️ About", callback_data="about")],
-            [InlineKeyboardButton("🔍 Search Files", callback_data="search_menu")]
-        ]
-        
-        if config.is_admin(query.from_user.id):
-            keyboard.extend([
-                [InlineKeyboardButton("🔄 Start Batch", callback_data="start_batch"),
-                 InlineKeyboardButton("✅ End Batch", callback_data="end_batch")],
-                [InlineKeyboardButton("✏️ Rename File", callback_data="rename_file")],
-                [InlineKeyboardButton("⚙️ Settings", callback_data="settings")]
-            ])
-        
-        if config.is_owner(query.from_user.id):
-            keyboard.append([
-                InlineKeyboardButton("📊 Performance", callback_data="performance"),
-                InlineKeyboardButton("🛠️ Admin Panel", callback_data="admin_panel")
-            ])
-        
-        reply_markup = InlineKeyboardMarkup(keyboard)
+        reply_markup = get_main_menu_markup(update)
         await query.edit_message_text(mikasa_reply('info') + "Main Menu:", reply_markup=reply_markup)
     
     elif query.data == "help":
-        help_text = (
-            f"{mikasa_reply('info')}Help Information:\n\n"
-            "• To access a file, use the provided link\n"
-            "• You need a valid token to access files\n"
-            "• Use /search <keywords> to find files\n\n"
-            "Commands:\n"
-            "/start - Start the bot\n"
-            "/menu - Show main menu\n"
-            "/help - Show this help\n"
-            "/search - Search for files"
-        )
-        
-        if config.is_admin(query.from_user.id):
-            help_text += (
-                "\n\nAdmin Commands:\n"
-                "/getlink - Store a file\n"
-                "/firstbatch - Start batch\n"
-                "/lastbatch - End batch\n"
-                "/rename - Rename next file\n"
-                "/ban <user_id> - Ban user\n"
-                "/unban <user_id> - Unban user\n"
-                "/settings - Show settings\n"
-                "/restart - Restart bot"
-            )
+        help_text = mikasa_reply('info') + get_help_text(query.from_user.id)
         
-        if config.is_owner(query.from_user.id):
-            help_text += (
-                "\n\nOwner Commands:\n"
-                "/tokentoggle - Toggle token verification\n"
-                "/performance - Show performance stats"
-            )
-        
-        keyboard = [[InlineKeyboardButton("🔙 Back", callback_data="menu")]]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        await query.edit_message_text(help_text, reply_markup=reply_markup)
+        await query.edit_message_text(help_text, reply_markup=BACK_TO_MENU_MARKUP)
     
     elif query.data == "about":
-        about_text = (
-            f"{mikasa_reply('info')}About This Bot:\n\n"
-            "High-performance file sharing bot with MongoDB integration.\n\n"
-            "Features:\n"
-            "• MongoDB storage with connection pooling\n"
-            "• Advanced caching system\n"
-            "• Rate limiting and performance monitoring\n"
-            "• Token verification system\n"
-            "• Batch file sharing\n"
-            "• Optimized for thousands of concurrent users\n"
-            "• Real-time performance statistics"
-        )
+        about_text = mikasa_reply('info') + ABOUT_TEXT
         
-        keyboard = [[InlineKeyboardButton("🔙 Back", callback_data="menu")]]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        await query.edit_message_text(about_text, reply_markup=reply_markup)
+        await query.edit_message_text(about_text, reply_markup=BACK_TO_MENU_MARKUP)
 
 @monitored
 async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Show help information"""
-    help_text = (
-        f"{mikasa_reply('info')}Help Information:\n\n"
-        "• To access a file, use the provided link\n"
-        "• You need a valid token to access files\n"
-        "• Use /search <keywords> to find files\n\n"
-        "Commands:\n"
-        "/start - Start the bot\n"
-        "/menu - Show main menu\n"
-        "/help - Show this help\n"
-        "/search - Search for files"
-    )
+    help_text = mikasa_reply('info') + get_help_text(update.effective_user.id)
     
-    if config.is_admin(update.effective_user.id):
-        help_text += (
-            "\n\nAdmin Commands:\n"
-            "/getlink - Store a file\n"
-            "/firstbatch - Start batch\n"
-            "/lastbatch - End batch\n"
-            "/rename - Rename next file\n"
-            "/ban <user_id> - Ban user\n"
-            "/unban <user_id> - Unban user\n"
-            "/settings - Show settings\n"
-            "/restart - Restart bot"
-        )
-    
-    if config.is_owner(update.effective_user.id):
-        help_text += (
-            "\n\nOwner Commands:\n"
-            "/tokentoggle - Toggle token verification\n"
-            "/performance - Show performance stats"
-        )
-    
-    keyboard = [[InlineKeyboardButton("📋 Main Menu", callback_data="menu")]]
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    await update.message.reply_text(help_text, reply_markup=reply_markup)
+    await update.message.reply_text(help_text, reply_markup=MAIN_MENU_MARKUP)
 
 # ========== MESSAGE HANDLER ========== #
-@monitored
+@monitored(sample_rate=0.1)
 async def message_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Handle all messages"""
+    """Handle non-command messages in private chats (group messages are filtered out at registration)"""
     if not update.message:
         return
     
@@ -1143,35 +1334,46 @@ async def message_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if hasattr(update.message, 'text') and update.message.text and update.message.text.startswith('/'):
         return
     
-    # In group chats, don't respond to regular messages
-    if update.effective_chat.type in ["group", "supergroup"]:
-        return
-    
-    # Only process file storage in private chats
-    if update.effective_chat.type == "private":
-        if config.is_admin(update.effective_user.id):
-            await store_file(update, context)
-        else:
-            await update.message.reply_text(
-                mikasa_reply('info') + "Use /menu to access the bot menu or /help for assistance."
-            )
+    # Only process file storage for admins
+    if config.is_admin(update.effective_user.id):
+        await store_file(update, context)
+    else:
+        await update.message.reply_text(
+            mikasa_reply('info') + "Use /menu to access the bot menu or /help for assistance."
+        )
 
 # ========== APPLICATION SETUP ========== #
+async def ensure_initial_token(application):
+    """Generate the initial token if no valid one exists"""
+    db = get_db()
+    token_info = await db.get_valid_token()
+    
+    if not token_info:
+        logger.info("Generating initial token")
+        await generate_token(0, application)
+
 async def post_init(application):
     """Initialize database and schedule tasks"""
     logger.info("Initializing optimized bot...")
     
+    # Cache the deep-link prefix once the bot identity is known
+    application.bot_data["start_link_prefix"] = f"t.me/{application.bot.username}?start="
+    
     # Initialize database connection
     mongodb_config = config.get_mongodb_config()
-    success = await init_database(mongodb_config["uri"], mongodb_config["database"])
+    success = await init_database(
+        mongodb_config.pop("uri"),
+        mongodb_config.pop("database"),
+        **mongodb_config
+    )
     if not success:
         logger.error("Failed to initialize database connection!")
         # sys.exit(1) # Commented out to allow bot to continue running even if DB connection fails initially
     # Start performance optimization background tasks
-    await cache.start()
-    await user_rate_limiter.start()    
-    # Preload cache
-    await preload_cache()
+    await user_rate_limiter.start()
+    if success:
+        await get_db().group_stats.start()
+        start_cache_watcher()
     
     # Schedule token refresh
     application.job_queue.run_repeating(
@@ -1181,26 +1383,33 @@ async def post_init(application):
         name="token_refresh"
     )
     
-    # Generate initial token if needed
-    db = get_db()
-    token_info = await db.get_valid_token()
-    
-    if not token_info:
-        logger.info("Generating initial token")
-        await generate_token(0, application)
+    # Preload cache and check the initial token concurrently; both only need the DB
+    await asyncio.gather(preload_cache(), ensure_initial_token(application))
     
     logger.info("Optimized bot initialization completed successfully")
 
 async def shutdown(application):
     """Cleanup on shutdown"""
     logger.info("Shutting down optimized bot...")
+    try:
+        await stop_cache_watcher()
+    except Exception as e:
+        logger.error(f"Error stopping cache watcher: {e}")
     await cleanup_resources()
     await close_database()
     logger.info("Bot shutdown completed")
 
 if __name__ == "__main__":
     # Initialize application
-    application = ApplicationBuilder().token(config.BOT_TOKEN).post_init(post_init).build()
+    # shutdown runs as post_shutdown so it still has run_polling's event loop,
+    # which owns the watcher, group stats and background write tasks
+    application = (
+        ApplicationBuilder()
+        .token(config.BOT_TOKEN)
+        .post_init(post_init)
+        .post_shutdown(shutdown)
+        .build()
+    )
     
     # Register handlers
     handlers = [
@@ -1221,9 +1430,11 @@ if __name__ == "__main__":
         CommandHandler("tokentoggle", token_toggle_command),
         CommandHandler("performance", performance_stats_command),
         CallbackQueryHandler(button_handler),
-        MessageHandler(filters.ALL & ~filters.COMMAND, message_handler)
+        MessageHandler(filters.ChatType.PRIVATE & ~filters.COMMAND, message_handler)
     ]
     
+    # Group -1 runs first for every update
+    application.add_handler(TypeHandler(Update, track_current_user), group=-1)
     for handler in handlers:
         application.add_handler(handler)
     
@@ -1237,7 +1448,4 @@ if __name__ == "__main__":
     except KeyboardInterrupt:
         logger.info("Bot stopped by user")
     except Exception as e:
-        logger.critical(f"Critical error: {e}")
-    finally:
-        # Cleanup
-        asyncio.run(shutdown(application))
\ No newline at end of file
+        logger.critical(f"Critical error: {e}")
\ No newline at end of file
@@ -5,8 +5,11 @@ Handles environment variables and configuration validation
 
 import os
 import logging
-from typing import List, Optional
-from dotenv import load_dotenv
+from typing import FrozenSet, List, Mapping, Optional
+from dotenv import dotenv_values, load_dotenv
+
+# The real process environment, captured before .env fills in what it lacks
+_PROCESS_ENV = dict(os.environ)
 
 # Load environment variables
 load_dotenv()
@@ -16,49 +19,118 @@ logger = logging.getLogger(__name__)
 class Config:
     """Configuration class with validation and defaults"""
     
+    # Fixed attribute layout; settings are read on every update
+    __slots__ = (
+        "BOT_TOKEN", "ADMINS", "ADMIN_SET", "OWNER_ID",
+        "DATABASE_CHANNEL", "LINKS_CHANNEL", "FORCE_SUB",
+        "TOKEN_DURATION", "TOKEN_VERIFICATION_ENABLED", "GET_TOKEN", "RENAME_TEMPLATE",
+        "MONGODB_URI", "MONGODB_DATABASE", "MONGODB_MAX_POOL_SIZE", "MONGODB_MIN_POOL_SIZE",
+        "MONGODB_MAX_IDLE_TIME_MS", "MONGODB_WAIT_QUEUE_TIMEOUT_MS",
+        "CACHE_TTL", "CACHE_MAX_SIZE", "RATE_LIMIT_REQUESTS", "RATE_LIMIT_WINDOW", "MAX_CONCURRENT_REQUESTS",
+        "LOG_LEVEL", "LOG_FILE",
+        "DEBUG",
+    )
+    
     # Telegram Bot Configuration
-    BOT_TOKEN: str = os.getenv("BOT_TOKEN", "")
-    ADMINS: List[int] = []
-    OWNER_ID: int = 0
-    DATABASE_CHANNEL: int = int(os.getenv("DATABASE_CHANNEL", "0"))
-    LINKS_CHANNEL: int = int(os.getenv("LINKS_CHANNEL", "0"))
-    FORCE_SUB: int = int(os.getenv("FORCE_SUB", "0"))
+    BOT_TOKEN: str
+    ADMINS: List[int]
+    ADMIN_SET: FrozenSet[int]
+    OWNER_ID: int
+    DATABASE_CHANNEL: int
+    LINKS_CHANNEL: int
+    FORCE_SUB: int
     
     # Token System Configuration
-    TOKEN_DURATION: int = int(os.getenv("TOKEN_DURATION", "24"))
-    TOKEN_VERIFICATION_ENABLED: bool = os.getenv("TOKEN_VERIFICATION_ENABLED", "1") == "1"
-    GET_TOKEN: str = os.getenv("GET_TOKEN", "")
-    RENAME_TEMPLATE: str = os.getenv("RENAME_TEMPLATE", "")
+    TOKEN_DURATION: int
+    TOKEN_VERIFICATION_ENABLED: bool
+    GET_TOKEN: str
+    RENAME_TEMPLATE: str
     
     # MongoDB Configuration
-    MONGODB_URI: str = os.getenv("MONGODB_URI", "")
-    MONGODB_DATABASE: str = os.getenv("MONGODB_DATABASE", "")
+    MONGODB_URI: str
+    MONGODB_DATABASE: str
 
-    MONGODB_MAX_POOL_SIZE: int = int(os.getenv("MONGODB_MAX_POOL_SIZE", "100"))
-    MONGODB_MIN_POOL_SIZE: int = int(os.getenv("MONGODB_MIN_POOL_SIZE", "10"))
+    MONGODB_MAX_POOL_SIZE: int
+    MONGODB_MIN_POOL_SIZE: int
+    MONGODB_MAX_IDLE_TIME_MS: int
+    MONGODB_WAIT_QUEUE_TIMEOUT_MS: int
     
     # Performance Configuration
-    CACHE_TTL: int = int(os.getenv("CACHE_TTL", "300"))
-    CACHE_MAX_SIZE: int = int(os.getenv("CACHE_MAX_SIZE", "10000"))
-    RATE_LIMIT_REQUESTS: int = int(os.getenv("RATE_LIMIT_REQUESTS", "30"))
-    RATE_LIMIT_WINDOW: int = int(os.getenv("RATE_LIMIT_WINDOW", "60"))
-    MAX_CONCURRENT_REQUESTS: int = int(os.getenv("MAX_CONCURRENT_REQUESTS", "100"))
+    CACHE_TTL: int
+    CACHE_MAX_SIZE: int
+    RATE_LIMIT_REQUESTS: int
+    RATE_LIMIT_WINDOW: int
+    MAX_CONCURRENT_REQUESTS: int
     
     # Logging Configuration
-    LOG_LEVEL: str = os.getenv("LOG_LEVEL", "INFO")
-    LOG_FILE: Optional[str] = os.getenv("LOG_FILE")
+    LOG_LEVEL: str
+    LOG_FILE: Optional[str]
     
     # Development Configuration
-    DEBUG: bool = os.getenv("DEBUG", "0") == "1"
+    DEBUG: bool
     
-    def __init__(self):
-        """Initialize configuration and validate required settings"""
-        self._parse_admins()
+    def __init__(self, env: Optional[Mapping[str, str]] = None):
+        """Initialize configuration from env (default: os.environ) and validate required settings"""
+        if env is None:
+            env = os.environ
+        self._load_env(env)
+        self._parse_admins(env)
         self._validate_config()
     
-    def _parse_admins(self):
+    def _load_env(self, env: Mapping[str, str]):
+        """Read settings from environment variables"""
+        # Telegram Bot Configuration
+        self.BOT_TOKEN = env.get("BOT_TOKEN", "")
+        self.DATABASE_CHANNEL = int(env.get("DATABASE_CHANNEL", "0"))
+        self.LINKS_CHANNEL = int(env.get("LINKS_CHANNEL", "0"))
+        self.FORCE_SUB = int(env.get("FORCE_SUB", "0"))
+        
+        # Token System Configuration
+        self.TOKEN_DURATION = int(env.get("TOKEN_DURATION", "24"))
+        self.TOKEN_VERIFICATION_ENABLED = env.get("TOKEN_VERIFICATION_ENABLED", "1") == "1"
+        self.GET_TOKEN = env.get("GET_TOKEN", "")
+        self.RENAME_TEMPLATE = env.get("RENAME_TEMPLATE", "")
+        
+        # MongoDB Configuration
+        self.MONGODB_URI = env.get("MONGODB_URI", "")
+        self.MONGODB_DATABASE = env.get("MONGODB_DATABASE", "")
+        
+        self.MONGODB_MAX_POOL_SIZE = int(env.get("MONGODB_MAX_POOL_SIZE", "200"))
+        self.MONGODB_MIN_POOL_SIZE = int(env.get("MONGODB_MIN_POOL_SIZE", "20"))
+        self.MONGODB_MAX_IDLE_TIME_MS = int(env.get("MONGODB_MAX_IDLE_TIME_MS", "300000"))
+        # Fail fast when the pool is exhausted instead of queueing indefinitely
+        self.MONGODB_WAIT_QUEUE_TIMEOUT_MS = int(env.get("MONGODB_WAIT_QUEUE_TIMEOUT_MS", "2000"))
+        
+        # Performance Configuration
+        self.CACHE_TTL = int(env.get("CACHE_TTL", "300"))
+        self.CACHE_MAX_SIZE = int(env.get("CACHE_MAX_SIZE", "10000"))
+        self.RATE_LIMIT_REQUESTS = int(env.get("RATE_LIMIT_REQUESTS", "30"))
+        self.RATE_LIMIT_WINDOW = int(env.get("RATE_LIMIT_WINDOW", "60"))
+        self.MAX_CONCURRENT_REQUESTS = int(env.get("MAX_CONCURRENT_REQUESTS", "100"))
+        
+        # Logging Configuration
+        self.LOG_LEVEL = env.get("LOG_LEVEL", "INFO")
+        self.LOG_FILE = env.get("LOG_FILE")
+        
+        # Development Configuration
+        self.DEBUG = env.get("DEBUG", "0") == "1"
+    
+    def reload(self):
+        """Re-read environment variables, keeping the current settings if the new ones are invalid"""
+        # Same precedence as startup: the process environment wins over .env,
+        # and settings since removed from .env fall back to their defaults
+        env = {key: value for key, value in dotenv_values().items() if value is not None}
+        env.update(_PROCESS_ENV)
+        fresh = Config(env)
+        for name in self.__slots__:
+            setattr(self, name, getattr(fresh, name))
+        logger.info("Configuration reloaded")
+    
+    def _parse_admins(self, env: Mapping[str, str]):
         """Parse ADMINS environment variable"""
-        admins_str = os.getenv("ADMINS", "")
+        self.ADMINS = []
+        self.OWNER_ID = 0
+        admins_str = env.get("ADMINS", "")
         if admins_str:
             try:
                 self.ADMINS = [int(id.strip()) for id in admins_str.split(",") if id.strip()]
@@ -67,6 +139,9 @@ class Config:
             except ValueError as e:
                 logger.error(f"Invalid ADMINS format: {e}")
                 self.ADMINS = []
+        
+        # Membership set for O(1) admin checks on every update
+        self.ADMIN_SET = frozenset(self.ADMINS)
     
     def _validate_config(self):
         """Validate required configuration"""
@@ -110,6 +185,8 @@ class Config:
             "database": self.MONGODB_DATABASE,
             "maxPoolSize": self.MONGODB_MAX_POOL_SIZE,
             "minPoolSize": self.MONGODB_MIN_POOL_SIZE,
+            "maxIdleTimeMS": self.MONGODB_MAX_IDLE_TIME_MS,
+            "waitQueueTimeoutMS": self.MONGODB_WAIT_QUEUE_TIMEOUT_MS,
             "serverSelectionTimeoutMS": 5000,
             "connectTimeoutMS": 10000,
             "socketTimeoutMS": 20000,
@@ -146,7 +223,7 @@ class Config:
     
     def is_admin(self, user_id: int) -> bool:
         """Check if user is an admin"""
-        return user_id in self.ADMINS
+        return user_id in self.ADMIN_SET
     
     def is_owner(self, user_id: int) -> bool:
         """Check if user is the owner"""
@@ -6,40 +6,311 @@ Optimized for high-performance handling of thousands of concurrent users
 import os
 import logging
 import asyncio
-import re
+from urllib.parse import urlsplit
 from datetime import datetime, timedelta, timezone
-from typing import Optional, Dict, List, Any
+from typing import Optional, Dict, List, Any, Callable, Iterable
 from motor.motor_asyncio import AsyncIOMotorClient, AsyncIOMotorDatabase, AsyncIOMotorCollection
-from pymongo import IndexModel, ASCENDING, DESCENDING, TEXT
-from pymongo.errors import DuplicateKeyError, ConnectionFailure, OperationFailure
+from pymongo import IndexModel, InsertOne, UpdateOne, ReadPreference, WriteConcern, ASCENDING, DESCENDING, TEXT
+from pymongo.errors import BulkWriteError, DuplicateKeyError, ConnectionFailure, OperationFailure
 
 # Configure logging
 logger = logging.getLogger(__name__)
 
+# Fields search results are rendered from; the rest of each file document stays on the server
+SEARCH_RESULT_PROJECTION = {
+    "_id": 0,
+    "file_id": 1,
+    "custom_name": 1,
+    "caption": 1,
+    "media_type": 1,
+    "message_id": 1
+}
+
+# Group document fields that update_group_settings may $set; counters and
+# member maps belong to the stats path and must not be overwritten wholesale
+GROUP_SETTINGS_FIELDS = frozenset({"auto_delete_minutes"})
+
+# Indexes created by earlier versions that no query uses any more (or that a
+# compound index now serves through its prefix); dropped at startup since
+# every one of them is maintained on each write
+OBSOLETE_INDEXES = {
+    "users": ("created_at_-1",),
+    "files": ("created_by_1_created_at_-1", "access_count_-1", "last_accessed_-1"),
+    "batches": ("created_at_-1", "created_by_1_created_at_-1", "access_count_-1"),
+    "tokens": ("user_id_1", "created_at_-1"),
+    "groups": ("last_activity_-1", "total_files_shared_-1"),
+    "system": ("updated_at_-1",)
+}
+
+def sanitize_uri(uri: str) -> str:
+    """Mask the credentials in a MongoDB URI, keeping the host list for debugging"""
+    parts = urlsplit(uri)
+    if "@" not in parts.netloc:
+        return uri
+    # rpartition: an unescaped '@' in the password must not leak the rest of it
+    hosts = parts.netloc.rpartition("@")[2]
+    return parts._replace(netloc=f"[USER]:[PASSWORD]@{hosts}").geturl()
+
+class _Batcher:
+    """Batching window shared by WriteBatcher and ReadBatcher: one flush timer plus references to running flushes"""
+    
+    def __init__(self, max_delay: float, max_batch: int):
+        self.max_delay = max_delay
+        self.max_batch = max_batch
+        self._flush_task: Optional[asyncio.Task] = None
+        # Every running flush task; asyncio itself only keeps weak references
+        self._flush_tasks: set = set()
+    
+    def _detach(self):
+        """Swap out and return everything pending (implemented by subclasses)"""
+        raise NotImplementedError
+    
+    async def _flush_batch(self, batch):
+        """Send one detached batch to the database (implemented by subclasses)"""
+        raise NotImplementedError
+    
+    def _queued(self, size: int):
+        """Start one flush for a full batch, or the batching timer for the first item queued"""
+        if size >= self.max_batch:
+            # Detach the full batch now so later callers start a new one
+            self._cancel_timer()
+            self._start_flush(self._flush_batch(self._detach()))
+        elif self._flush_task is None:
+            self._flush_task = self._start_flush(self._delayed_flush())
+    
+    def _cancel_timer(self):
+        """Cancel the batching timer if it is still sleeping"""
+        # _delayed_flush clears the attribute before it flushes
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            self._flush_task = None
+    
+    def _start_flush(self, coro) -> asyncio.Task:
+        """Run a flush as a task, holding a reference so it cannot be garbage collected mid-flight"""
+        task = asyncio.create_task(coro)
+        self._flush_tasks.add(task)
+        task.add_done_callback(self._flush_tasks.discard)
+        return task
+    
+    async def _delayed_flush(self):
+        """Flush once the batching window has passed"""
+        await asyncio.sleep(self.max_delay)
+        self._flush_task = None
+        await self.flush()
+    
+    async def flush(self):
+        """Flush everything pending right away"""
+        await self._flush_batch(self._detach())
+    
+    async def close(self):
+        """Cancel the batching timer, wait for running flushes, then flush whatever is still pending"""
+        self._cancel_timer()
+        if self._flush_tasks:
+            await asyncio.gather(*self._flush_tasks, return_exceptions=True)
+        await self.flush()
+
+class WriteBatcher(_Batcher):
+    """Buffer inserts for a collection and flush them together with one unordered bulk_write"""
+    
+    def __init__(self, collection: AsyncIOMotorCollection, max_delay: float = 0.01, max_batch: int = 256):
+        super().__init__(max_delay, max_batch)
+        self.collection = collection
+        self._queue: List = []
+    
+    async def insert(self, doc: Dict) -> bool:
+        """Queue a document for insertion and wait for its batch to be written"""
+        future = asyncio.get_running_loop().create_future()
+        self._queue.append((doc, future))
+        self._queued(len(self._queue))
+        return await future
+    
+    def _detach(self) -> List:
+        """Take the queued (doc, future) pairs"""
+        batch, self._queue = self._queue, []
+        return batch
+    
+    async def _flush_batch(self, batch: List):
+        """Insert one batch with a single bulk_write, resolving each caller with its own result"""
+        if not batch:
+            return
+        
+        write_errors = {}
+        try:
+            await self.collection.bulk_write([InsertOne(doc) for doc, _ in batch], ordered=False)
+        except BulkWriteError as e:
+            write_errors = {error["index"]: error for error in e.details.get("writeErrors", [])}
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        
+        for index, (_, future) in enumerate(batch):
+            if future.done():
+                continue
+            
+            error = write_errors.get(index)
+            if error is None:
+                future.set_result(True)
+            elif error.get("code") == 11000:
+                future.set_exception(DuplicateKeyError(error.get("errmsg", ""), 11000, error))
+            else:
+                future.set_exception(OperationFailure(error.get("errmsg", ""), error.get("code"), error))
+
+class ReadBatcher(_Batcher):
+    """Coalesce concurrent lookups by key into one $in query"""
+    
+    def __init__(self, collection: AsyncIOMotorCollection, key_field: str,
+                 projection: Optional[Dict] = None, max_delay: float = 0.002, max_batch: int = 256):
+        super().__init__(max_delay, max_batch)
+        self.collection = collection
+        self.key_field = key_field
+        self.projection = projection
+        self._pending: Dict[Any, asyncio.Future] = {}
+    
+    async def load(self, key: Any) -> Optional[Dict]:
+        """Look up one document by key, sharing the query with concurrent callers"""
+        future = self._pending.get(key)
+        if future is None:
+            future = self._pending[key] = asyncio.get_running_loop().create_future()
+            self._queued(len(self._pending))
+        
+        # Shielded so one cancelled caller doesn't fail the others waiting on this key
+        return await asyncio.shield(future)
+    
+    def _detach(self) -> Dict[Any, asyncio.Future]:
+        """Take the pending key -> future map"""
+        pending, self._pending = self._pending, {}
+        return pending
+    
+    async def _flush_batch(self, pending: Dict[Any, asyncio.Future]):
+        """Fetch one set of keys with a single $in query, resolving missing ones to None"""
+        if not pending:
+            return
+        
+        try:
+            cursor = self.collection.find({self.key_field: {"$in": list(pending)}}, self.projection)
+            docs = {doc[self.key_field]: doc for doc in await cursor.to_list(length=None)}
+        except Exception as e:
+            for future in pending.values():
+                if not future.done():
+                    future.set_exception(e)
+            return
+        
+        for key, future in pending.items():
+            if not future.done():
+                future.set_result(docs.get(key))
+
+class GroupStatsBuffer:
+    """Merge group statistic increments in memory and flush them periodically"""
+    
+    def __init__(self, manager: "DatabaseManager", flush_interval: float = 5.0,
+                 max_chats: int = 10000, max_terms: int = 50000):
+        self.manager = manager
+        self.flush_interval = flush_interval
+        self.max_chats = max_chats
+        self.max_terms = max_terms
+        self._pending: Dict[int, Dict[str, int]] = {}
+        self._terms: Dict[tuple, int] = {}
+        self._flush_task: Optional[asyncio.Task] = None
+    
+    def record(self, chat_id: int, increments: Dict[str, int], search_term: str = None) -> bool:
+        """Add increments for a chat; returns False if dropped because the buffer is full"""
+        term_key = (chat_id, search_term) if search_term else None
+        if term_key is not None and term_key not in self._terms and len(self._terms) >= self.max_terms:
+            return False
+        
+        pending = self._pending.get(chat_id)
+        if pending is None:
+            if len(self._pending) >= self.max_chats:
+                return False
+            pending = self._pending[chat_id] = {}
+        
+        for field, amount in increments.items():
+            pending[field] = pending.get(field, 0) + amount
+        if term_key is not None:
+            self._terms[term_key] = self._terms.get(term_key, 0) + 1
+        return True
+    
+    async def start(self):
+        """Start background flush task for GroupStatsBuffer"""
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._flush_loop())
+    
+    async def stop(self):
+        """Stop background flush task and write what is still pending"""
+        if self._flush_task:
+            self._flush_task.cancel()
+            try:
+                await self._flush_task
+            except asyncio.CancelledError:
+                pass
+            self._flush_task = None
+        await self.flush()
+    
+    async def _flush_loop(self):
+        """Periodically write merged increments"""
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"Error flushing group stats: {e}")
+    
+    async def flush(self):
+        """Write all pending increments in one bulk write"""
+        pending, self._pending = self._pending, {}
+        terms, self._terms = self._terms, {}
+        if pending or terms:
+            await self.manager.update_group_stats_bulk(pending, terms)
+
 class DatabaseManager:
     """Async MongoDB database manager with connection pooling and optimization"""
     
-    def __init__(self, mongodb_uri: str, database_name: str):
+    def __init__(self, mongodb_uri: str, database_name: str, **client_options):
         self.mongodb_uri = mongodb_uri
+        # Overrides for the AsyncIOMotorClient defaults in connect()
+        self.client_options = client_options
         self.database_name = "Cluster0" # Explicitly set database name from URI appName
         self.client: Optional[AsyncIOMotorClient] = None
         self.db: Optional[AsyncIOMotorDatabase] = None
         self._collections: Dict[str, AsyncIOMotorCollection] = {}
+        # Each collection is also bound as an attribute, set in _initialize_collections
+        self.users: Optional[AsyncIOMotorCollection] = None
+        self.files: Optional[AsyncIOMotorCollection] = None
+        self.batches: Optional[AsyncIOMotorCollection] = None
+        self.tokens: Optional[AsyncIOMotorCollection] = None
+        self.groups: Optional[AsyncIOMotorCollection] = None
+        self.system: Optional[AsyncIOMotorCollection] = None
+        self.group_terms: Optional[AsyncIOMotorCollection] = None
+        # Views for reads that tolerate replication lag, offloading the primary
+        self.users_secondary: Optional[AsyncIOMotorCollection] = None
+        self.tokens_secondary: Optional[AsyncIOMotorCollection] = None
+        # Views for best-effort statistics writes
+        self.groups_stats: Optional[AsyncIOMotorCollection] = None
+        self.group_terms_stats: Optional[AsyncIOMotorCollection] = None
+        self._batchers: Dict[str, WriteBatcher] = {}
+        self._loaders: Dict[str, ReadBatcher] = {}
+        self._background_writes: set = set()
+        self._write_slots: Optional[asyncio.Semaphore] = None
+        self.group_stats = GroupStatsBuffer(self)
         
     async def connect(self):
         """Establish connection to MongoDB with optimized settings"""
         try:
-            self.client = AsyncIOMotorClient(
-                self.mongodb_uri,
-                maxPoolSize=100,
-                minPoolSize=10,
-                maxIdleTimeMS=30000,
-                serverSelectionTimeoutMS=5000,
-                connectTimeoutMS=10000,
-                socketTimeoutMS=20000,
-                retryWrites=True,
-                retryReads=True
-            )
+            options = {
+                "maxPoolSize": 200,
+                "minPoolSize": 20,
+                "serverSelectionTimeoutMS": 5000,
+                "connectTimeoutMS": 10000,
+                "socketTimeoutMS": 20000,
+                "retryWrites": True,
+                "retryReads": True,
+                "appname": "telegram-bot",
+                "compressors": "zstd,zlib"
+            }
+            options.update(self.client_options)
+            self.client = AsyncIOMotorClient(self.mongodb_uri, **options)
             
             # Test authentication explicitly
             try:
@@ -49,7 +320,7 @@ class DatabaseManager:
                 if "Authentication failed" in str(e):
                     logger.critical("MongoDB authentication failed. Check credentials in connection URI.")
                     # Log sanitized URI for debugging (without password)
-                    sanitized_uri = re.sub(r"://(.*?):(.*?)@", "://[USER]:[PASSWORD]@", self.mongodb_uri)
+                    sanitized_uri = sanitize_uri(self.mongodb_uri)
                     logger.debug(f"Connection URI: {sanitized_uri}")
                     return False
                 raise
@@ -70,73 +341,121 @@ class DatabaseManager:
     async def _initialize_collections(self):
         """Initialize collections and create indexes"""
         # Define collections
-        collection_names = ["users", "files", "batches", "tokens", "groups", "system"]
+        collection_names = ["users", "files", "batches", "tokens", "groups", "system", "group_terms"]
         
         for name in collection_names:
             self._collections[name] = self.db[name]
+            setattr(self, name, self._collections[name])
+        
+        self.users_secondary = self.users.with_options(read_preference=ReadPreference.SECONDARY_PREFERRED)
+        self.tokens_secondary = self.tokens.with_options(read_preference=ReadPreference.SECONDARY_PREFERRED)
+        
+        # Stats counters are acknowledged by the primary alone, without waiting
+        # for the journal or a majority; losing a few increments on failover is fine
+        stats_concern = WriteConcern(w=1, j=False)
+        self.groups_stats = self.groups.with_options(write_concern=stats_concern)
+        self.group_terms_stats = self.group_terms.with_options(write_concern=stats_concern)
+        
+        # Coalesce bursts of uploads into bulk writes
+        for name in ("files", "batches"):
+            self._batchers[name] = WriteBatcher(self._collections[name])
+        
+        # Coalesce concurrent per-update ban checks into one $in query
+        self._loaders["banned_users"] = ReadBatcher(
+            self.users, "user_id", {"_id": 0, "user_id": 1, "is_banned": 1}
+        )
+        self._loaders["files"] = ReadBatcher(self.files, "file_id")
+        
+        # Bound concurrent fire-and-forget access counter updates
+        self._write_slots = asyncio.Semaphore(256)
         
         # Create indexes for performance
         await self._create_indexes()
     
     async def _create_indexes(self):
-        """Create database indexes for optimal performance"""
-        try:
-            # Users collection indexes
-            await self._collections["users"].create_indexes([
+        """Create database indexes for optimal performance, all collections concurrently"""
+        index_models = {
+            # Users collection indexes; only banned users are ever looked up by is_banned
+            "users": [
                 IndexModel([("user_id", ASCENDING)], unique=True),
-                IndexModel([("is_banned", ASCENDING)]),
-                IndexModel([("created_at", DESCENDING)])
-            ])
+                IndexModel([("is_banned", ASCENDING)], partialFilterExpression={"is_banned": True})
+            ],
             
             # Files collection indexes
-            await self._collections["files"].create_indexes([
+            "files": [
                 IndexModel([("file_id", ASCENDING)], unique=True),
-                IndexModel([("created_at", DESCENDING)]),
-                IndexModel([("created_by", ASCENDING), ("created_at", DESCENDING)]),
-                IndexModel([("custom_name", TEXT), ("caption", TEXT)]),  # Text search
-                IndexModel([("access_count", DESCENDING)]),
-                IndexModel([("last_accessed", DESCENDING)])
-            ])
+                IndexModel([("created_at", DESCENDING)]),  # Date search
+                IndexModel([("custom_name", TEXT), ("caption", TEXT)])  # Text search
+            ],
             
             # Batches collection indexes
-            await self._collections["batches"].create_indexes([
-                IndexModel([("batch_id", ASCENDING)], unique=True),
-                IndexModel([("created_at", DESCENDING)]),
-                IndexModel([("created_by", ASCENDING), ("created_at", DESCENDING)]),
-                IndexModel([("access_count", DESCENDING)])
-            ])
+            "batches": [
+                IndexModel([("batch_id", ASCENDING)], unique=True)
+            ],
             
             # Tokens collection indexes (with TTL for automatic cleanup)
-            await self._collections["tokens"].create_indexes([
+            "tokens": [
                 IndexModel([("token", ASCENDING)], unique=True),
                 IndexModel([("expiry", ASCENDING)], expireAfterSeconds=0),  # TTL index
-                IndexModel([("user_id", ASCENDING)]),
-                IndexModel([("created_at", DESCENDING)])
-            ])
+                IndexModel([("user_id", ASCENDING), ("expiry", ASCENDING)])  # Equality, then range
+            ],
             
-            # Groups collection indexes
-            await self._collections["groups"].create_indexes([
-                IndexModel([("chat_id", ASCENDING)], unique=True),
-                IndexModel([("last_activity", DESCENDING)]),
-                IndexModel([("total_files_shared", DESCENDING)])
-            ])
+            # Groups collection indexes. The unique chat_id index is also what a
+            # hashed shard key needs: sh.shardCollection("<db>.groups", {chat_id: "hashed"})
+            # spreads per-chat stats writes once a single primary becomes the bottleneck.
+            "groups": [
+                IndexModel([("chat_id", ASCENDING)], unique=True)
+            ],
             
-            # System collection indexes
-            await self._collections["system"].create_indexes([
-                IndexModel([("key", ASCENDING)], unique=True),
-                IndexModel([("updated_at", DESCENDING)])
-            ])
+            # Group search term counters, one document per (chat, term)
+            "group_terms": [
+                IndexModel([("chat_id", ASCENDING), ("term", ASCENDING)], unique=True)
+            ],
             
+            # System collection indexes
+            "system": [
+                IndexModel([("key", ASCENDING)], unique=True)
+            ]
+        }
+        
+        results = await asyncio.gather(
+            *(self._sync_indexes(name, models) for name, models in index_models.items()),
+            return_exceptions=True
+        )
+        
+        failed = False
+        for name, result in zip(index_models, results):
+            if isinstance(result, Exception):
+                failed = True
+                logger.error(f"Error creating indexes for {name}: {result}")
+        
+        if not failed:
             logger.info("Database indexes created successfully")
-            
-        except Exception as e:
-            logger.error(f"Error creating indexes: {e}")
+    
+    async def _sync_indexes(self, name: str, models: List[IndexModel]):
+        """Drop obsolete or outdated indexes on a collection, then create the current ones"""
+        collection = self._collections[name]
+        existing = await collection.index_information()
+        
+        stale = [index_name for index_name in OBSOLETE_INDEXES.get(name, ()) if index_name in existing]
+        # An index whose partial filter changed keeps its name, and create_indexes
+        # rejects the new options until the old definition is gone
+        for model in models:
+            spec = model.document
+            current = existing.get(spec["name"])
+            if current and current.get("partialFilterExpression") != spec.get("partialFilterExpression"):
+                stale.append(spec["name"])
+        
+        for index_name in stale:
+            await collection.drop_index(index_name)
+        
+        await collection.create_indexes(models)
     
     # User operations
     async def get_user(self, user_id: int) -> Optional[Dict]:
         """Get user by ID"""
         try:
-            return await self._collections["users"].find_one({"user_id": user_id})
+            return await self.users.find_one({"user_id": user_id})
         except Exception as e:
             logger.error(f"Error getting user {user_id}: {e}")
             return None
@@ -144,11 +463,8 @@ class DatabaseManager:
     async def is_user_banned(self, user_id: int) -> bool:
         """Check if user is banned (optimized for frequent calls)"""
         try:
-            user = await self._collections["users"].find_one(
-                {"user_id": user_id, "is_banned": True},
-                {"_id": 1}  # Only return _id field for efficiency
-            )
-            return user is not None
+            user = await self._loaders["banned_users"].load(user_id)
+            return user is not None and user.get("is_banned") is True
         except Exception as e:
             logger.error(f"Error checking ban status for user {user_id}: {e}")
             return False
@@ -156,17 +472,18 @@ class DatabaseManager:
     async def ban_user(self, user_id: int, reason: str = "") -> bool:
         """Ban a user"""
         try:
-            await self._collections["users"].update_one(
+            now = datetime.now(timezone.utc)
+            await self.users.update_one(
                 {"user_id": user_id},
                 {
                     "$set": {
                         "is_banned": True,
-                        "ban_date": datetime.now(timezone.utc),
+                        "ban_date": now,
                         "ban_reason": reason,
-                        "updated_at": datetime.now(timezone.utc)
+                        "updated_at": now
                     },
                     "$setOnInsert": {
-                        "created_at": datetime.now(timezone.utc)
+                        "created_at": now
                     }
                 },
                 upsert=True
@@ -180,7 +497,7 @@ class DatabaseManager:
     async def unban_user(self, user_id: int) -> bool:
         """Unban a user"""
         try:
-            result = await self._collections["users"].update_one(
+            result = await self.users.update_one(
                 {"user_id": user_id},
                 {
                     "$set": {
@@ -200,10 +517,10 @@ class DatabaseManager:
     async def get_banned_users(self) -> List[int]:
         """Get list of banned user IDs"""
         try:
-            cursor = self._collections["users"].find(
+            cursor = self.users_secondary.find(
                 {"is_banned": True},
                 {"user_id": 1, "_id": 0}
-            )
+            ).batch_size(1000)
             users = await cursor.to_list(length=None)
             return [user["user_id"] for user in users]
         except Exception as e:
@@ -231,7 +548,7 @@ class DatabaseManager:
                 "last_accessed": None
             }
             
-            await self._collections["files"].insert_one(file_doc)
+            await self._batchers["files"].insert(file_doc)
             logger.info(f"Saved file {file_id}")
             return True
             
@@ -242,23 +559,51 @@ class DatabaseManager:
             logger.error(f"Error saving file {file_id}: {e}")
             return False
     
+    def _record_access(self, collection_name: str, key_field: str, keys: List) -> None:
+        """Increment access counters in the background, off the read path"""
+        task = asyncio.create_task(self._increment_access(collection_name, key_field, keys))
+        self._background_writes.add(task)
+        task.add_done_callback(self._background_writes.discard)
+    
+    async def _increment_access(self, collection_name: str, key_field: str, keys: List):
+        """Bump access_count and last_accessed for the given documents"""
+        async with self._write_slots:
+            try:
+                await self._collections[collection_name].update_many(
+                    {key_field: {"$in": keys}},
+                    {
+                        "$inc": {"access_count": 1},
+                        "$set": {"last_accessed": datetime.now(timezone.utc)}
+                    }
+                )
+            except Exception as e:
+                logger.error(f"Error updating access count in {collection_name}: {e}")
+    
     async def get_file(self, file_id: str) -> Optional[Dict]:
         """Get file by ID and increment access count"""
         try:
-            # Update access count and last accessed time
-            result = await self._collections["files"].find_one_and_update(
-                {"file_id": file_id},
-                {
-                    "$inc": {"access_count": 1},
-                    "$set": {"last_accessed": datetime.now(timezone.utc)}
-                },
-                return_document=True
-            )
+            result = await self._loaders["files"].load(file_id)
+            if result:
+                self._record_access("files", "file_id", [file_id])
             return result
         except Exception as e:
             logger.error(f"Error getting file {file_id}: {e}")
             return None
     
+    async def get_files(self, file_ids: List[str]) -> Dict[str, Dict]:
+        """Get multiple files by ID in a single query and increment their access counts"""
+        try:
+            cursor = self.files.find({"file_id": {"$in": file_ids}})
+            files = await cursor.to_list(length=None)
+            
+            if files:
+                self._record_access("files", "file_id", [doc["file_id"] for doc in files])
+            
+            return {doc["file_id"]: doc for doc in files}
+        except Exception as e:
+            logger.error(f"Error getting files {file_ids}: {e}")
+            return {}
+    
     async def search_files(self, query: str, date_filter: str = None,
                           limit: int = 50) -> List[Dict]:
         """Search files by text query and optional date filter"""
@@ -281,9 +626,10 @@ class DatabaseManager:
                 except ValueError:
                     logger.warning(f"Invalid date format: {date_filter}")
             
-            cursor = self._collections["files"].find(search_filter).limit(limit)
+            cursor = self.files.find(search_filter, SEARCH_RESULT_PROJECTION).limit(limit)
             
-            # Sort by relevance if text search, otherwise by date
+            # Sort by relevance if text search, otherwise by date; with the limit
+            # the server keeps only a top-k heap instead of sorting every match
             if query:
                 cursor = cursor.sort([("score", {"$meta": "textScore"})])
             else:
@@ -312,7 +658,7 @@ class DatabaseManager:
                 "last_accessed": None
             }
             
-            await self._collections["batches"].insert_one(batch_doc)
+            await self._batchers["batches"].insert(batch_doc)
             logger.info(f"Saved batch {batch_id} with {len(files)} files")
             return True
             
@@ -326,14 +672,9 @@ class DatabaseManager:
     async def get_batch(self, batch_id: str) -> Optional[Dict]:
         """Get batch by ID and increment access count"""
         try:
-            result = await self._collections["batches"].find_one_and_update(
-                {"batch_id": batch_id},
-                {
-                    "$inc": {"access_count": 1},
-                    "$set": {"last_accessed": datetime.now(timezone.utc)}
-                },
-                return_document=True
-            )
+            result = await self.batches.find_one({"batch_id": batch_id})
+            if result:
+                self._record_access("batches", "batch_id", [batch_id])
             return result
         except Exception as e:
             logger.error(f"Error getting batch {batch_id}: {e}")
@@ -352,7 +693,7 @@ class DatabaseManager:
                 "last_used": None
             }
             
-            await self._collections["tokens"].insert_one(token_doc)
+            await self.tokens.insert_one(token_doc)
             logger.info(f"Saved token for user {user_id}, expires at {expiry}")
             return True
             
@@ -366,14 +707,15 @@ class DatabaseManager:
     async def verify_token(self, token: str) -> Optional[int]:
         """Verify token and return user_id if valid"""
         try:
-            result = await self._collections["tokens"].find_one_and_update(
+            now = datetime.now(timezone.utc)
+            result = await self.tokens.find_one_and_update(
                 {
                     "token": token,
-                    "expiry": {"$gt": datetime.now(timezone.utc)}
+                    "expiry": {"$gt": now}
                 },
                 {
                     "$inc": {"used_count": 1},
-                    "$set": {"last_used": datetime.now(timezone.utc)}
+                    "$set": {"last_used": now}
                 },
                 return_document=True
             )
@@ -389,13 +731,12 @@ class DatabaseManager:
     async def check_user_token(self, user_id: int) -> bool:
         """Check if user has a valid token"""
         try:
-            token = await self._collections["tokens"].find_one({
-                "$or": [
-                    {"user_id": user_id},
-                    {"user_id": 0}  # System tokens valid for all users
-                ],
+            # System tokens (user_id 0) are valid for all users. Projecting only
+            # indexed fields lets the (user_id, expiry) index cover the query.
+            token = await self.tokens.find_one({
+                "user_id": {"$in": [user_id, 0]},
                 "expiry": {"$gt": datetime.now(timezone.utc)}
-            })
+            }, {"_id": 0, "user_id": 1})
             return token is not None
         except Exception as e:
             logger.error(f"Error checking user token: {e}")
@@ -404,7 +745,7 @@ class DatabaseManager:
     async def get_valid_token(self) -> Optional[Dict]:
         """Get a valid system token (user_id = 0)"""
         try:
-            return await self._collections["tokens"].find_one({
+            return await self.tokens_secondary.find_one({
                 "user_id": 0,
                 "expiry": {"$gt": datetime.now(timezone.utc)}
             }, sort=[("expiry", DESCENDING)])
@@ -416,35 +757,40 @@ class DatabaseManager:
     async def get_group_settings(self, chat_id: int) -> Dict:
         """Get group settings"""
         try:
-            group = await self._collections["groups"].find_one({"chat_id": chat_id})
+            group = await self.groups.find_one({"chat_id": chat_id})
             if group:
                 return group
             
             # Return default settings if group not found
+            now = datetime.now(timezone.utc)
             return {
                 "chat_id": chat_id,
                 "auto_delete_minutes": 0,
                 "total_files_shared": 0,
                 "total_searches": 0,
                 "active_members": {},
-                "search_terms": {},
-                "last_activity": datetime.now(timezone.utc),
-                "created_at": datetime.now(timezone.utc)
+                "last_activity": now,
+                "created_at": now
             }
         except Exception as e:
             logger.error(f"Error getting group settings for {chat_id}: {e}")
             return {}
     
     async def update_group_settings(self, chat_id: int, settings: Dict) -> bool:
-        """Update group settings"""
+        """Update group settings; pass only the fields that changed"""
+        unknown = settings.keys() - GROUP_SETTINGS_FIELDS
+        if unknown:
+            logger.error(f"Unknown group settings for {chat_id}: {sorted(unknown)}")
+            return False
+        
         try:
-            settings["updated_at"] = datetime.now(timezone.utc)
+            now = datetime.now(timezone.utc)
             
-            await self._collections["groups"].update_one(
+            await self.groups.update_one(
                 {"chat_id": chat_id},
                 {
-                    "$set": settings,
-                    "$setOnInsert": {"created_at": datetime.now(timezone.utc)}
+                    "$set": {**settings, "updated_at": now},
+                    "$setOnInsert": {"created_at": now}
                 },
                 upsert=True
             )
@@ -453,49 +799,104 @@ class DatabaseManager:
             logger.error(f"Error updating group settings for {chat_id}: {e}")
             return False
     
+    @staticmethod
+    def _group_stats_increments(action_type: str, user_id: int = None) -> Dict[str, int]:
+        """Get the group document counter increments for a group action"""
+        increments = {}
+        
+        if action_type == "file":
+            increments["total_files_shared"] = 1
+        elif action_type == "search":
+            increments["total_searches"] = 1
+        
+        if user_id:
+            increments[f"active_members.{user_id}"] = 1
+        
+        return increments
+    
+    @staticmethod
+    def _group_stats_update(chat_id: int, increments: Dict[str, int]) -> Dict:
+        """Build an upsert for group stats whose $setOnInsert defaults never overlap $inc paths"""
+        now = datetime.now(timezone.utc)
+        set_on_insert = {
+            "chat_id": chat_id,
+            "created_at": now,
+            "auto_delete_minutes": 0
+        }
+        
+        # MongoDB rejects an update that touches the same path in two operators
+        for field in ("total_files_shared", "total_searches"):
+            if field not in increments:
+                set_on_insert[field] = 0
+        if not any(path.startswith("active_members.") for path in increments):
+            set_on_insert["active_members"] = {}
+        
+        update_doc = {
+            "$set": {"last_activity": now},
+            "$setOnInsert": set_on_insert
+        }
+        if increments:
+            update_doc["$inc"] = increments
+        return update_doc
+    
     async def update_group_stats(self, chat_id: int, action_type: str,
                                 user_id: int = None, search_term: str = None) -> bool:
         """Update group statistics"""
         try:
-            update_doc = {
-                "$set": {"last_activity": datetime.now(timezone.utc)},
-                "$setOnInsert": {
-                    "chat_id": chat_id,
-                    "created_at": datetime.now(timezone.utc),
-                    "auto_delete_minutes": 0,
-                    "total_files_shared": 0,
-                    "total_searches": 0,
-                    "active_members": {},
-                    "search_terms": {}
-                }
-            }
-            
-            if action_type == "file":
-                update_doc["$inc"] = {"total_files_shared": 1}
-            elif action_type == "search":
-                update_doc["$inc"] = {"total_searches": 1}
-                if search_term:
-                    update_doc["$inc"][f"search_terms.{search_term}"] = 1
-            
-            if user_id:
-                update_doc["$inc"][f"active_members.{user_id}"] = 1
+            increments = self._group_stats_increments(action_type, user_id)
             
-            await self._collections["groups"].update_one(
+            await self.groups_stats.update_one(
                 {"chat_id": chat_id},
-                update_doc,
+                self._group_stats_update(chat_id, increments),
                 upsert=True
             )
+            
+            if action_type == "search" and search_term:
+                await self.group_terms_stats.update_one(
+                    {"chat_id": chat_id, "term": search_term},
+                    {"$inc": {"count": 1}},
+                    upsert=True
+                )
             return True
             
         except Exception as e:
             logger.error(f"Error updating group stats for {chat_id}: {e}")
             return False
     
+    def queue_group_stats(self, chat_id: int, action_type: str,
+                          user_id: int = None, search_term: str = None) -> bool:
+        """Queue a group statistics update to be written by the background flush"""
+        increments = self._group_stats_increments(action_type, user_id)
+        if action_type != "search":
+            search_term = None
+        return self.group_stats.record(chat_id, increments, search_term)
+    
+    async def update_group_stats_bulk(self, increments_by_chat: Dict[int, Dict[str, int]],
+                                      term_counts: Dict[tuple, int] = None) -> bool:
+        """Apply merged group statistics and (chat_id, term) search counts in bulk writes"""
+        try:
+            if increments_by_chat:
+                await self.groups_stats.bulk_write([
+                    UpdateOne({"chat_id": chat_id}, self._group_stats_update(chat_id, increments), upsert=True)
+                    for chat_id, increments in increments_by_chat.items()
+                ], ordered=False)
+            
+            if term_counts:
+                await self.group_terms_stats.bulk_write([
+                    UpdateOne({"chat_id": chat_id, "term": term}, {"$inc": {"count": count}}, upsert=True)
+                    for (chat_id, term), count in term_counts.items()
+                ], ordered=False)
+            return True
+            
+        except Exception as e:
+            logger.error(f"Error bulk updating group stats for {len(increments_by_chat)} chats: {e}")
+            return False
+    
     # System operations
     async def get_system_value(self, key: str) -> Any:
         """Get system configuration value"""
         try:
-            doc = await self._collections["system"].find_one({"key": key})
+            doc = await self.system.find_one({"key": key})
             return doc["value"] if doc else None
         except Exception as e:
             logger.error(f"Error getting system value {key}: {e}")
@@ -504,7 +905,7 @@ class DatabaseManager:
     async def set_system_value(self, key: str, value: Any) -> bool:
         """Set system configuration value"""
         try:
-            await self._collections["system"].update_one(
+            await self.system.update_one(
                 {"key": key},
                 {
                     "$set": {
@@ -519,6 +920,22 @@ class DatabaseManager:
             logger.error(f"Error setting system value {key}: {e}")
             return False
     
+    # Change streams
+    async def watch_changes(self, collection_names: Iterable[str], on_change: Callable[[Dict], None]):
+        """Stream insert/update/replace events on the given collections into on_change.
+        
+        Requires a replica set or sharded cluster (as on Atlas); raises
+        OperationFailure on a standalone server.
+        """
+        pipeline = [{"$match": {
+            "ns.coll": {"$in": list(collection_names)},
+            "operationType": {"$in": ["insert", "update", "replace"]}
+        }}]
+        
+        async with self.db.watch(pipeline, full_document="updateLookup") as stream:
+            async for change in stream:
+                on_change(change)
+    
     # Health check
     async def health_check(self) -> bool:
         """Check database connection health"""
@@ -531,18 +948,31 @@ class DatabaseManager:
 
     async def close(self):
         """Close the MongoDB connection."""
-        if self.client:
-            self.client.close()
-            logger.info("MongoDB connection closed")
+        try:
+            await self.group_stats.stop()
+            for batcher in self._batchers.values():
+                await batcher.close()
+            for loader in self._loaders.values():
+                await loader.close()
+            if self._background_writes:
+                await asyncio.gather(*self._background_writes, return_exceptions=True)
+        except Exception as e:
+            logger.error(f"Error draining pending writes on close: {e}")
+        finally:
+            if self.client:
+                # Motor's close() is synchronous; it closes pooled sockets directly
+                self.client.close()
+                self.client = None
+                logger.info("MongoDB connection closed")
 
 # Global database instance
 db_manager: Optional[DatabaseManager] = None
 
-async def init_database(mongodb_uri: str, database_name: str) -> bool:
+async def init_database(mongodb_uri: str, database_name: str, **client_options) -> bool:
     """Initialize global database connection"""
     global db_manager
     
-    db_manager = DatabaseManager(mongodb_uri, database_name)
+    db_manager = DatabaseManager(mongodb_uri, database_name, **client_options)
     return await db_manager.connect()
 
 async def close_database():
@@ -1,171 +1,210 @@
 """
 Performance Optimization Module for High-Concurrency Telegram Bot
 Includes caching, rate limiting, connection pooling, and monitoring
+
+Keys filled by preload_cache() are exported as CACHE_KEY_* constants;
+import them instead of retyping the literals.
 """
 
 import asyncio
 import time
+import random
 import logging
-from typing import Dict, Any, Optional, Callable
+from typing import Dict, Any, Optional, Callable, Hashable, Awaitable
 from functools import wraps
-from collections import defaultdict, deque
-from datetime import datetime, timedelta
-import weakref
+from contextvars import ContextVar
+from collections import OrderedDict
+from array import array
 
 logger = logging.getLogger(__name__)
 
+# Clock for all internal TTLs, refills and durations; immune to wall-clock steps
+_now = time.monotonic
+
+# User behind the update being handled, set once per update by the bot's
+# entry handler; @monitored reads it instead of inspecting handler arguments
+current_user_id: ContextVar[Optional[int]] = ContextVar("current_user_id", default=None)
+
+# Well-known cache keys written by preload_cache()
+CACHE_KEY_SYSTEM_SETTINGS = "system_settings"
+CACHE_KEY_VALID_TOKEN = "valid_system_token"
+
 class MemoryCache:
     """High-performance in-memory cache with TTL support"""
     
-    def __init__(self, default_ttl: int = 300, max_size: int = 10000):
+    __slots__ = ("default_ttl", "max_size", "bucket_seconds", "_cache", "_expiry_buckets", "_next_bucket", "hits", "misses", "_in_flight")
+    
+    def __init__(self, default_ttl: int = 300, max_size: int = 10000, bucket_seconds: int = 10):
         self.default_ttl = default_ttl
         self.max_size = max_size
-        self._cache: Dict[str, Dict[str, Any]] = {}
-        self._access_times: Dict[str, float] = {}
-        self._cleanup_task: Optional[asyncio.Task] = None
+        self.bucket_seconds = bucket_seconds
+        # key -> (expires_at, value), kept in LRU order (least recently used first)
+        self._cache: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        # Expiry wheel: bucket index -> keys expiring inside that bucket
+        self._expiry_buckets: Dict[int, set] = {}
+        self._next_bucket = int(_now() // bucket_seconds)
+        # Lookups made through get_or_compute
+        self.hits = 0
+        self.misses = 0
+        # key -> task computing it for get_or_compute, joined by concurrent missers
+        self._in_flight: Dict[Hashable, asyncio.Future] = {}
 
-    async def start(self):
-        """Start background cleanup task for MemoryCache"""
-        if self._cleanup_task is None or (self._cleanup_task.done() if self._cleanup_task else False):
-            self._cleanup_task = asyncio.create_task(self._cleanup_expired())
-
-    async def stop(self):
-        """Stop background cleanup task for MemoryCache"""
-        if self._cleanup_task:
-            self._cleanup_task.cancel()
-            try:
-                await self._cleanup_task
-            except asyncio.CancelledError:
-                pass
-            self._cleanup_task = None
-    
-    async def _cleanup_expired(self):
-        """Background task to clean up expired entries"""
-        while True:
-            try:
-                current_time = time.time()
-                expired_keys = []
-                
-                for key, data in self._cache.items():
-                    if current_time > data["expires_at"]:
-                        expired_keys.append(key)
-                
-                for key in expired_keys:
-                    self._cache.pop(key, None)
-                    self._access_times.pop(key, None)
-                
-                # If cache is too large, remove least recently used items
-                if len(self._cache) > self.max_size:
-                    # Sort by access time and remove oldest
-                    sorted_keys = sorted(self._access_times.items(), key=lambda x: x[1])
-                    keys_to_remove = sorted_keys[:len(self._cache) - self.max_size]
-                    
-                    for key, _ in keys_to_remove:
-                        self._cache.pop(key, None)
-                        self._access_times.pop(key, None)
-                
-                logger.debug(f"Cache cleanup: {len(expired_keys)} expired, {len(self._cache)} remaining")
-                
-                # Sleep for 60 seconds before next cleanup
-                await asyncio.sleep(60)
-                
-            except Exception as e:
-                logger.error(f"Error in cache cleanup: {e}")
-                await asyncio.sleep(60)
+    def _evict_expired_buckets(self, current_time: float) -> int:
+        """Drop keys from every bucket that has fully elapsed"""
+        current_bucket = int(current_time // self.bucket_seconds)
+        expired_count = 0
+        
+        for bucket in range(self._next_bucket, current_bucket):
+            for key in self._expiry_buckets.pop(bucket, ()):
+                entry = self._cache.get(key)
+                # The key may have been overwritten with a later expiry since
+                if entry is not None and current_time > entry[0]:
+                    del self._cache[key]
+                    expired_count += 1
+        
+        self._next_bucket = max(self._next_bucket, current_bucket)
+        return expired_count
     
-    def get(self, key: str) -> Optional[Any]:
-        """Get value from cache"""
-        if key not in self._cache:
+    def get(self, key: Hashable, now: Optional[float] = None) -> Optional[Any]:
+        """Get value from cache (now: a _now() reading the caller already took)"""
+        entry = self._cache.get(key)
+        if entry is None:
             return None
         
-        data = self._cache[key]
-        current_time = time.time()
-        
-        if current_time > data["expires_at"]:
+        if (now if now is not None else _now()) > entry[0]:
             # Expired
-            self._cache.pop(key, None)
-            self._access_times.pop(key, None)
+            del self._cache[key]
             return None
         
-        # Update access time
-        self._access_times[key] = current_time
-        return data["value"]
+        # Mark as most recently used
+        self._cache.move_to_end(key)
+        return entry[1]
     
-    def set(self, key: str, value: Any, ttl: Optional[int] = None) -> None:
-        """Set value in cache with TTL"""
+    def set(self, key: Hashable, value: Any, ttl: Optional[int] = None, now: Optional[float] = None) -> None:
+        """Set value in cache with TTL (now: a _now() reading the caller already took)"""
         if ttl is None:
             ttl = self.default_ttl
         
-        current_time = time.time()
-        expires_at = current_time + ttl
+        if now is None:
+            now = _now()
+        expires_at = now + ttl
         
-        self._cache[key] = {
-            "value": value,
-            "expires_at": expires_at
-        }
-        self._access_times[key] = current_time
+        self._cache[key] = (expires_at, value)
+        self._cache.move_to_end(key)
+        
+        bucket = int(expires_at // self.bucket_seconds)
+        self._expiry_buckets.setdefault(bucket, set()).add(key)
+        
+        # Maintenance is done inline by writers instead of a background task:
+        # drop buckets that elapsed since the last write, then enforce the LRU bound
+        if now >= (self._next_bucket + 1) * self.bucket_seconds:
+            self._evict_expired_buckets(now)
+        if len(self._cache) > self.max_size:
+            self._cache.popitem(last=False)
     
-    def delete(self, key: str) -> bool:
-        """Delete key from cache"""
-        if key in self._cache:
-            self._cache.pop(key, None)
-            self._access_times.pop(key, None)
-            return True
-        return False
+    async def get_or_compute(self, key: Hashable, compute: Callable[[], Awaitable[Any]], ttl: Optional[int] = None) -> Any:
+        """Return the cached value for key, or await compute() and cache its result"""
+        now = _now()
+        entry = self._cache.get(key)
+        # Hit path inlined from get(); expired entries are overwritten by set() below
+        if entry is not None and now <= entry[0] and entry[1] is not None:
+            self._cache.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+        
+        self.misses += 1
+        future = self._in_flight.get(key)
+        if future is None:
+            async def fill():
+                try:
+                    value = await compute()
+                    # delete()/clear() during the computation detach this fill;
+                    # its value may predate the invalidation, so it is not cached
+                    if self._in_flight.get(key) is future:
+                        self.set(key, value, ttl, now)
+                    return value
+                finally:
+                    if self._in_flight.get(key) is future:
+                        del self._in_flight[key]
+            
+            future = asyncio.ensure_future(fill())
+            self._in_flight[key] = future
+        
+        # Shield so one caller being cancelled does not cancel the shared computation
+        return await asyncio.shield(future)
+    
+    def delete(self, key: Hashable) -> bool:
+        """Delete key from cache, including a result still being computed for it"""
+        self._in_flight.pop(key, None)
+        return self._cache.pop(key, None) is not None
     
     def clear(self) -> None:
         """Clear all cache entries"""
         self._cache.clear()
-        self._access_times.clear()
+        self._expiry_buckets.clear()
+        self._in_flight.clear()
     
     def stats(self) -> Dict[str, Any]:
         """Get cache statistics"""
+        lookups = self.hits + self.misses
         return {
             "size": len(self._cache),
             "max_size": self.max_size,
-            "hit_rate": getattr(self, "_hit_rate", 0.0),
-            "miss_rate": getattr(self, "_miss_rate", 0.0)
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "miss_rate": self.misses / lookups if lookups else 0.0
         }
 
 class RateLimiter:
-    """Token bucket rate limiter for API calls"""
+    """Token bucket rate limiter for API calls (for use from a single event loop)"""
+    
+    __slots__ = ("max_tokens", "refill_rate", "tokens", "last_refill")
     
     def __init__(self, max_tokens: int = 100, refill_rate: float = 10.0):
         self.max_tokens = max_tokens
         self.refill_rate = refill_rate
         self.tokens = max_tokens
-        self.last_refill = time.time()
-        self._lock = asyncio.Lock()
+        self.last_refill = _now()
+    
+    def _take(self, tokens: int) -> float:
+        """Refill, then take tokens if available; returns 0 on success or the seconds until enough refill"""
+        now = _now()
+        
+        # Refill tokens based on time passed
+        time_passed = now - self.last_refill
+        tokens_to_add = time_passed * self.refill_rate
+        self.tokens = min(self.max_tokens, self.tokens + tokens_to_add)
+        self.last_refill = now
+        
+        if self.tokens >= tokens:
+            self.tokens -= tokens
+            return 0.0
+        
+        return (tokens - self.tokens) / self.refill_rate
     
     async def acquire(self, tokens: int = 1) -> bool:
         """Acquire tokens from the bucket"""
-        async with self._lock:
-            now = time.time()
-            
-            # Refill tokens based on time passed
-            time_passed = now - self.last_refill
-            tokens_to_add = time_passed * self.refill_rate
-            self.tokens = min(self.max_tokens, self.tokens + tokens_to_add)
-            self.last_refill = now
-            
-            if self.tokens >= tokens:
-                self.tokens -= tokens
-                return True
-            
-            return False
+        # No lock needed: _take never suspends, so it is atomic on the event loop
+        return self._take(tokens) == 0.0
     
     async def wait_for_tokens(self, tokens: int = 1) -> None:
-        """Wait until tokens are available"""
-        while not await self.acquire(tokens):
-            await asyncio.sleep(0.1)
+        """Wait until tokens are available, sleeping exactly until the refill covers them"""
+        while True:
+            wait = self._take(tokens)
+            if wait == 0.0:
+                return
+            await asyncio.sleep(wait)
 
 class UserRateLimiter:
-    """Per-user rate limiting"""
+    """Per-user token bucket rate limiting"""
+    
+    __slots__ = ("max_requests", "window_seconds", "refill_rate", "buckets", "_cleanup_task")
     
     def __init__(self, max_requests: int = 30, window_seconds: int = 60):
         self.max_requests = max_requests
         self.window_seconds = window_seconds
-        self.user_requests: Dict[int, deque] = defaultdict(deque)
+        self.refill_rate = max_requests / window_seconds
+        # user_id -> [tokens, last_refill]; a list is mutated in place on each check
+        self.buckets: Dict[int, list] = {}
         self._cleanup_task: Optional[asyncio.Task] = None
 
     async def start(self):
@@ -183,82 +222,113 @@ class UserRateLimiter:
                 pass
             self._cleanup_task = None
     
+    def _cleanup_once(self) -> int:
+        """Drop buckets that have been idle long enough to be full again"""
+        cutoff_time = _now() - self.window_seconds
+        # A bucket idle for a whole window has refilled to capacity,
+        # which is the same state a new user starts in
+        idle = [user_id for user_id, bucket in self.buckets.items() if bucket[1] < cutoff_time]
+        for user_id in idle:
+            del self.buckets[user_id]
+        return len(idle)
+    
     async def _cleanup_old_requests(self):
-        """Clean up old request records"""
+        """Run _cleanup_once every 30 seconds until cancelled"""
         while True:
             try:
-                current_time = time.time()
-                cutoff_time = current_time - self.window_seconds
-                
-                for user_id in list(self.user_requests.keys()):
-                    requests = self.user_requests[user_id]
-                    
-                    # Remove old requests
-                    while requests and requests[0] < cutoff_time:
-                        requests.popleft()
-                    
-                    # Remove empty deques
-                    if not requests:
-                        del self.user_requests[user_id]
-                
-                await asyncio.sleep(30)  # Cleanup every 30 seconds
-                
+                self._cleanup_once()
             except Exception as e:
-                logger.error(f"Error in user rate limiter cleanup: {e}")
-                await asyncio.sleep(30)
+                # CancelledError is not an Exception, so only cleanup bugs land here
+                logger.error(f"Error in user rate limiter cleanup: {e}", exc_info=True)
+            await asyncio.sleep(30)
     
     def is_allowed(self, user_id: int) -> bool:
         """Check if user is allowed to make a request"""
-        current_time = time.time()
-        cutoff_time = current_time - self.window_seconds
+        now = _now()
+        bucket = self.buckets.get(user_id)
         
-        requests = self.user_requests[user_id]
+        if bucket is None:
+            bucket = self.buckets[user_id] = [float(self.max_requests), now]
+        else:
+            # Refill tokens based on time passed since the last check
+            bucket[0] = min(self.max_requests, bucket[0] + (now - bucket[1]) * self.refill_rate)
+            bucket[1] = now
         
-        # Remove old requests
-        while requests and requests[0] < cutoff_time:
-            requests.popleft()
-        
-        # Check if under limit
-        if len(requests) < self.max_requests:
-            requests.append(current_time)
+        if bucket[0] >= 1.0:
+            bucket[0] -= 1.0
             return True
         
         return False
     
     def get_reset_time(self, user_id: int) -> float:
-        """Get time when rate limit resets for user"""
-        requests = self.user_requests[user_id]
-        if not requests:
+        """Get time (on the _now() clock) when the next request will be allowed for user"""
+        bucket = self.buckets.get(user_id)
+        if bucket is None or bucket[0] >= 1.0:
             return 0
         
-        return requests[0] + self.window_seconds
+        return _now() + (1.0 - bucket[0]) / self.refill_rate
+
+class RequestCoalescer:
+    """Share a single in-flight call between concurrent callers using the same key"""
+    
+    __slots__ = ("_inflight",)
+    
+    def __init__(self):
+        self._inflight: Dict[Hashable, asyncio.Future] = {}
+    
+    async def run(self, key: Hashable, func: Callable, *args, **kwargs) -> Any:
+        """Await func(*args, **kwargs), joining an identical call already in flight"""
+        future = self._inflight.get(key)
+        
+        if future is None:
+            future = asyncio.ensure_future(func(*args, **kwargs))
+            self._inflight[key] = future
+            
+            def _done(_, key=key, future=future):
+                if self._inflight.get(key) is future:
+                    del self._inflight[key]
+            
+            future.add_done_callback(_done)
+        
+        # Shield so one caller being cancelled does not cancel the shared call
+        return await asyncio.shield(future)
 
 class ConnectionPool:
     """Async connection pool for database operations"""
     
+    __slots__ = ("create_connection", "max_connections", "_pool", "_created_connections", "_leases")
+    
     def __init__(self, create_connection: Callable, max_connections: int = 50):
         self.create_connection = create_connection
         self.max_connections = max_connections
-        self._pool: asyncio.Queue = asyncio.Queue(maxsize=max_connections)
+        # LIFO: the most recently released (warmest) connection is reused first
+        self._pool: asyncio.LifoQueue = asyncio.LifoQueue(maxsize=max_connections)
         self._created_connections = 0
-        self._lock = asyncio.Lock()
+        # One lease per checked-out connection. A connection is only created
+        # while holding a lease with no idle one available, so checked-out plus
+        # idle connections never exceed max_connections, and every release
+        # wakes exactly one waiter.
+        self._leases = asyncio.Semaphore(max_connections)
     
     async def acquire(self):
         """Acquire a connection from the pool"""
+        await self._leases.acquire()
+        
         try:
             # Try to get an existing connection
-            connection = self._pool.get_nowait()
-            return connection
+            return self._pool.get_nowait()
         except asyncio.QueueEmpty:
-            # Create new connection if under limit
-            async with self._lock:
-                if self._created_connections < self.max_connections:
-                    connection = await self.create_connection()
-                    self._created_connections += 1
-                    return connection
-            
-            # Wait for a connection to become available
-            return await self._pool.get()
+            pass
+        
+        try:
+            connection = await self.create_connection()
+        except BaseException:
+            # A failed create must not leak the lease
+            self._leases.release()
+            raise
+        
+        self._created_connections += 1
+        return connection
     
     async def release(self, connection):
         """Release a connection back to the pool"""
@@ -266,9 +336,11 @@ class ConnectionPool:
             self._pool.put_nowait(connection)
         except asyncio.QueueFull:
             # Pool is full, close the connection
+            self._created_connections -= 1
             if hasattr(connection, "close"):
                 await connection.close()
-            self._created_connections -= 1
+        finally:
+            self._leases.release()
     
     async def close_all(self):
         """Close all connections in the pool"""
@@ -285,116 +357,145 @@ class ConnectionPool:
 class PerformanceMonitor:
     """Monitor bot performance metrics"""
     
-    def __init__(self):
-        self.metrics = {
-            "requests_total": 0,
-            "requests_per_second": 0,
-            "average_response_time": 0,
-            "error_rate": 0,
-            "active_users": set(),
-            "database_queries": 0,
-            "cache_hits": 0,
-            "cache_misses": 0
-        }
-        self.response_times = deque(maxlen=1000)
+    __slots__ = (
+        "requests_total", "database_queries", "cache_hits", "cache_misses",
+        "error_count", "response_times", "_rt_index", "_rt_count", "start_time", "_started",
+        "active_window", "active_users", "_previous_active_users", "_active_window_start", "_process"
+    )
+    
+    def __init__(self, active_window: int = 300, history_size: int = 1000):
+        # Counters are plain attributes; the reporting dict is built in get_stats()
+        self.requests_total = 0
+        self.database_queries = 0
+        self.cache_hits = 0
+        self.cache_misses = 0
         self.error_count = 0
-        self.start_time = time.time()
-        self._last_reset = time.time()
+        # Ring of the last history_size response times as C doubles
+        self.response_times = array("d", [0.0]) * history_size
+        self._rt_index = 0
+        self._rt_count = 0
+        self.start_time = time.time()  # Wall clock, for uptime display
+        self._started = _now()
+        # active_users holds the current window; with the previous one it
+        # bounds the set to users seen in the last one to two windows
+        self.active_window = active_window
+        self.active_users: set = set()
+        self._previous_active_users: set = set()
+        self._active_window_start = self._started
+        # psutil.Process handle reused across stats calls (False if psutil is missing)
+        self._process = None
     
-    def record_request(self, response_time: float, user_id: int, success: bool = True):
-        """Record a request"""
-        self.metrics["requests_total"] += 1
-        self.response_times.append(response_time)
-        self.metrics["active_users"].add(user_id)
+    def record_request(self, response_time: float, user_id: int, success: bool = True, weight: float = 1):
+        """Record a request (weight > 1 stands in for unsampled requests)
+
+        Only raw counters are updated here; rates and averages are derived in get_stats().
+        """
+        self.requests_total += weight
+        ring = self.response_times
+        i = self._rt_index
+        ring[i] = response_time
+        self._rt_index = i + 1 if i + 1 < len(ring) else 0
+        if self._rt_count < len(ring):
+            self._rt_count += 1
+        
+        self.record_user(user_id)
         
         if not success:
             self.error_count += 1
-        
-        # Update averages
-        if self.response_times:
-            self.metrics["average_response_time"] = sum(self.response_times) / len(self.response_times)
-        
-        # Calculate requests per second
-        current_time = time.time()
-        time_diff = current_time - self._last_reset
-        if time_diff >= 60:  # Reset every minute
-            self.metrics["requests_per_second"] = self.metrics["requests_total"] / time_diff
-            self._last_reset = current_time
-        
-        # Calculate error rate
-        if self.metrics["requests_total"] > 0:
-            self.metrics["error_rate"] = self.error_count / self.metrics["requests_total"]
+    
+    def record_user(self, user_id: int):
+        """Count a user as active without recording a request (for calls skipped by sampling)"""
+        current_time = _now()
+        if current_time - self._active_window_start >= self.active_window:
+            self._previous_active_users = self.active_users
+            self.active_users = set()
+            self._active_window_start = current_time
+        self.active_users.add(user_id)
     
     def record_database_query(self):
         """Record a database query"""
-        self.metrics["database_queries"] += 1
+        self.database_queries += 1
     
     def record_cache_hit(self):
         """Record a cache hit"""
-        self.metrics["cache_hits"] += 1
+        self.cache_hits += 1
     
     def record_cache_miss(self):
         """Record a cache miss"""
-        self.metrics["cache_misses"] += 1
+        self.cache_misses += 1
     
     def get_stats(self) -> Dict[str, Any]:
         """Get current performance statistics"""
         uptime = time.time() - self.start_time
         
-        cache_total = self.metrics["cache_hits"] + self.metrics["cache_misses"]
-        cache_hit_rate = (self.metrics["cache_hits"] / cache_total * 100) if cache_total > 0 else 0
+        # @cached lookups are counted by the cache itself
+        cache_hits = self.cache_hits + cache.hits
+        cache_total = cache_hits + self.cache_misses + cache.misses
+        cache_hit_rate = (cache_hits / cache_total * 100) if cache_total > 0 else 0
+        
+        # Unfilled ring slots are 0.0, so summing the whole ring is exact
+        samples = self._rt_count
+        average_response_time = sum(self.response_times) / samples if samples else 0
+        elapsed = _now() - self._started
+        requests_per_second = self.requests_total / elapsed if elapsed > 0 else 0
+        error_rate = self.error_count / self.requests_total if self.requests_total else 0
         
         return {
             "uptime_seconds": uptime,
-            "requests_total": self.metrics["requests_total"],
-            "requests_per_second": self.metrics["requests_per_second"],
-            "average_response_time_ms": self.metrics["average_response_time"] * 1000,
-            "error_rate_percent": self.metrics["error_rate"] * 100,
-            "active_users_count": len(self.metrics["active_users"]),
-            "database_queries": self.metrics["database_queries"],
+            # Sampled requests carry fractional weights
+            "requests_total": round(self.requests_total),
+            "requests_per_second": requests_per_second,
+            "average_response_time_ms": average_response_time * 1000,
+            "error_rate_percent": error_rate * 100,
+            "active_users_count": len(self.active_users | self._previous_active_users),
+            "database_queries": self.database_queries,
             "cache_hit_rate_percent": cache_hit_rate,
             "memory_usage_mb": self._get_memory_usage()
         }
     
     def _get_memory_usage(self) -> float:
         """Get current memory usage in MB"""
-        try:
-            import psutil
-            process = psutil.Process()
-            return process.memory_info().rss / 1024 / 1024
-        except ImportError:
+        if self._process is None:
+            try:
+                import psutil
+                self._process = psutil.Process()
+            except ImportError:
+                self._process = False
+        
+        if not self._process:
             return 0.0
+        return self._process.memory_info().rss / 1024 / 1024
 
 # Global instances (initialized without starting background tasks)
 cache = MemoryCache(default_ttl=300, max_size=10000)
 rate_limiter = RateLimiter(max_tokens=100, refill_rate=10.0)
 user_rate_limiter = UserRateLimiter(max_requests=30, window_seconds=60)
 performance_monitor = PerformanceMonitor()
+request_coalescer = RequestCoalescer()
 
 def cached(ttl: int = 300, key_func: Optional[Callable] = None):
     """Decorator for caching function results"""
     def decorator(func):
+        name = func.__qualname__
+        
+        def make_key(*args, **kwargs):
+            """Generate cache key"""
+            if key_func:
+                return key_func(*args, **kwargs)
+            key = (name, args, tuple(sorted(kwargs.items()))) if kwargs else (name, args)
+            try:
+                hash(key)
+            except TypeError:
+                # Unhashable arguments (lists, dicts) fall back to their repr
+                key = (name, repr(args), repr(sorted(kwargs.items())))
+            return key
+        
         @wraps(func)
         async def wrapper(*args, **kwargs):
-            # Generate cache key
-            if key_func:
-                cache_key = key_func(*args, **kwargs)
-            else:
-                cache_key = f"{func.__name__}:{hash(str(args) + str(sorted(kwargs.items())))}"
-            
-            # Try to get from cache
-            result = cache.get(cache_key)
-            if result is not None:
-                performance_monitor.record_cache_hit()
-                return result
-            
-            performance_monitor.record_cache_miss()
-            
-            # Execute function and cache result
-            result = await func(*args, **kwargs)
-            cache.set(cache_key, result, ttl)
-            
-            return result
+            return await cache.get_or_compute(make_key(*args, **kwargs), lambda: func(*args, **kwargs), ttl)
+        
+        # Drop the cached result for the given call arguments
+        wrapper.cache_invalidate = lambda *args, **kwargs: cache.delete(make_key(*args, **kwargs))
         return wrapper
     return decorator
 
@@ -407,7 +508,7 @@ def rate_limited(max_requests: int = 30, window_seconds: int = 60):
             
             if not user_rate_limiter.is_allowed(user_id):
                 reset_time = user_rate_limiter.get_reset_time(user_id)
-                wait_time = reset_time - time.time()
+                wait_time = reset_time - _now()
                 
                 await update.message.reply_text(
                     f"⚠️ Rate limit exceeded. Please wait {int(wait_time)} seconds."
@@ -418,32 +519,45 @@ def rate_limited(max_requests: int = 30, window_seconds: int = 60):
         return wrapper
     return decorator
 
-def monitored(func):
-    """Decorator for monitoring function performance"""
-    @wraps(func)
-    async def wrapper(*args, **kwargs):
-        start_time = time.time()
-        success = True
-        user_id = None
-        
-        try:
-            # Try to extract user_id from update
-            if args and hasattr(args[0], "effective_user"):
-                user_id = args[0].effective_user.id
-            
-            result = await func(*args, **kwargs)
-            return result
-            
-        except Exception as e:
-            success = False
-            raise e
+def monitored(func: Optional[Callable] = None, *, sample_rate: float = 1.0):
+    """Decorator for monitoring function performance
+
+    Use as @monitored, or @monitored(sample_rate=0.1) on hot handlers to record
+    only a fraction of successful calls; each sample is weighted by 1/sample_rate.
+    Failures are always recorded, and every caller counts as an active user.
+    """
+    if not 0 < sample_rate <= 1:
+        raise ValueError(f"sample_rate must be in (0, 1], got {sample_rate}")
+    weight = 1 / sample_rate
+    
+    def decorator(func):
+        @wraps(func)
+        async def wrapper(*args, **kwargs):
+            start_time = _now()
+            success = True
+            user_id = current_user_id.get()
             
-        finally:
-            response_time = time.time() - start_time
-            if user_id:
-                performance_monitor.record_request(response_time, user_id, success)
+            try:
+                result = await func(*args, **kwargs)
+                return result
+                
+            except Exception as e:
+                success = False
+                raise e
+                
+            finally:
+                if user_id:
+                    response_time = _now() - start_time
+                    if not success:
+                        performance_monitor.record_request(response_time, user_id, success)
+                    elif sample_rate >= 1 or random.random() < sample_rate:
+                        performance_monitor.record_request(response_time, user_id, success, weight)
+                    else:
+                        performance_monitor.record_user(user_id)
+        
+        return wrapper
     
-    return wrapper
+    return decorator(func) if func is not None else decorator
 
 async def optimize_database_queries():
     """Optimize database queries by batching and caching"""
@@ -457,15 +571,16 @@ async def preload_cache():
         
         db = get_db()
         
-        # Preload system settings
-        system_settings = await db.get_system_value("bot_settings")
+        # Preload system settings and frequently accessed tokens
+        system_settings, valid_token = await asyncio.gather(
+            db.get_system_value("bot_settings"),
+            db.get_valid_token()
+        )
         if system_settings:
-            cache.set("system_settings", system_settings, ttl=3600)
+            cache.set(CACHE_KEY_SYSTEM_SETTINGS, system_settings, ttl=3600)
         
-        # Preload frequently accessed tokens
-        valid_token = await db.get_valid_token()
         if valid_token:
-            cache.set("valid_system_token", valid_token, ttl=1800)
+            cache.set(CACHE_KEY_VALID_TOKEN, valid_token, ttl=1800)
         
         logger.info("Cache preloaded successfully")
         
@@ -476,7 +591,6 @@ async def cleanup_resources():
     """Cleanup resources on shutdown"""
     try:
         # Cancel cleanup tasks
-        await cache.stop()
         await user_rate_limiter.stop()
         
         # Clear cache
@@ -489,15 +603,15 @@ async def cleanup_resources():
 
 # Utility functions for performance optimization
 async def batch_database_operations(operations: list, batch_size: int = 100):
-    """Batch database operations for better performance"""
-    results = []
+    """Run database operations with at most batch_size in flight, results in input order"""
+    semaphore = asyncio.Semaphore(batch_size)
     
-    for i in range(0, len(operations), batch_size):
-        batch = operations[i:i + batch_size]
-        batch_results = await asyncio.gather(*batch, return_exceptions=True)
-        results.extend(batch_results)
+    async def run(operation):
+        async with semaphore:
+            return await operation
     
-    return results
+    # A sliding window: a slow operation no longer holds back the whole next batch
+    return await asyncio.gather(*(run(op) for op in operations), return_exceptions=True)
 
 def get_performance_stats() -> Dict[str, Any]:
     """Get current performance statistics"""